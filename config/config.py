@@ -1,117 +1,170 @@
 import os
 import json
-from typing import Optional, List, Any
-from pydantic import BaseModel, Field
-from qdrant_client import QdrantClient
+import logging
+import orjson
+from pathlib import Path
+from types import MappingProxyType
+from functools import lru_cache
+from typing import Optional, List, Any, Mapping
+from pydantic import BaseModel, ConfigDict
 from sparql_llm.utils import SparqlEndpointLinks
 from enum import Enum
 
+# Settings are resolved before the service logger is set up, stdlib logging still reports to stderr then
+_logger = logging.getLogger(__name__)
+
 # Load external configuration
 CONFIG_FILE = os.getenv("CONFIG_FILE", "/config/config.json")
 file_config = {}
-if os.path.exists(CONFIG_FILE):
-    try:
-        with open(CONFIG_FILE, "r") as f:
-            file_config = json.load(f)
-            print(f"Loaded configuration from {CONFIG_FILE}")
-    except Exception as e:
-        print(f"Error loading config from {CONFIG_FILE}: {e}")
-
-def get_config_value(env_key: str, config_key: str, default: Any) -> Any:
+try:
+    file_config = orjson.loads(Path(CONFIG_FILE).read_bytes())
+    print(f"Loaded configuration from {CONFIG_FILE}")
+except FileNotFoundError:
+    pass
+except Exception as e:
+    print(f"Error loading config from {CONFIG_FILE}: {e}")
+
+# Freeze the loaded file configuration so it can't be mutated after startup
+file_config = MappingProxyType(file_config)
+
+def get_config_value(env_key: str, config_key: str, default: Any, env: Optional[Mapping[str, str]] = None) -> Any:
     """
     Retrieve setting with priority: Environment Variable > Config File > Default.
     """
-    val = os.getenv(env_key)
-    if val is not None:
-        return val
-    if config_key in file_config:
-        return file_config[config_key]
-    return default
+    env = os.environ if env is None else env
+    return env.get(env_key) or file_config.get(config_key, default)
+
+def get_config_str(env_key: str, config_key: str, default: Optional[str], env: Optional[Mapping[str, str]] = None) -> Optional[str]:
+    val = get_config_value(env_key, config_key, default, env)
+    return None if val is None else str(val)
+
+def get_config_lower(env_key: str, config_key: str, default: str, env: Optional[Mapping[str, str]] = None) -> str:
+    return str(get_config_value(env_key, config_key, default, env)).lower()
 
-def get_config_bool(env_key: str, config_key: str, default: str) -> bool:
-    val = get_config_value(env_key, config_key, default)
+def get_config_bool(env_key: str, config_key: str, default: Any, env: Optional[Mapping[str, str]] = None) -> bool:
+    val = get_config_value(env_key, config_key, default, env)
     if isinstance(val, bool):
         return val
     return str(val).lower() == "true"
 
-def get_config_int(env_key: str, config_key: str, default: str) -> int:
-    val = get_config_value(env_key, config_key, default)
+def get_config_int(env_key: str, config_key: str, default: Any, env: Optional[Mapping[str, str]] = None) -> int:
+    val = get_config_value(env_key, config_key, default, env)
     return int(val)
 
-def get_config_float(env_key: str, config_key: str, default: str) -> float:
-    val = get_config_value(env_key, config_key, default)
+def get_config_float(env_key: str, config_key: str, default: Any, env: Optional[Mapping[str, str]] = None) -> float:
+    val = get_config_value(env_key, config_key, default, env)
     return float(val)
 
-def get_config_list(env_key: str, config_key: str, default: Optional[List[str]] = None) -> Optional[List[str]]:
-    val = os.getenv(env_key)
+def get_config_list(env_key: str, config_key: str, default: Optional[List[str]] = None, env: Optional[Mapping[str, str]] = None) -> Optional[List[str]]:
+    env = os.environ if env is None else env
+    val = env.get(env_key)
     if val:
         return [t.strip() for t in val.split(",")]
-    if config_key in file_config and isinstance(file_config[config_key], list):
-        return file_config[config_key]
-    if config_key in file_config and isinstance(file_config[config_key], str):
-        return [t.strip() for t in file_config[config_key].split(",")]
+    val = file_config.get(config_key)
+    if isinstance(val, list):
+        return val
+    if isinstance(val, str):
+        return [t.strip() for t in val.split(",")]
     return default
     
-def get_config_dict(env_key: str, config_key: str, default: dict) -> dict:
-    val = os.getenv(env_key)
+def get_config_json_list(env_key: str, config_key: str, default: List[str], env: Optional[Mapping[str, str]] = None) -> List[str]:
+    """Like get_config_list, but the environment variable holds a JSON array, for values that contain commas."""
+    env = os.environ if env is None else env
+    val = env.get(env_key)
+    if val:
+        try:
+            return json.loads(val)
+        except json.JSONDecodeError as e:
+            _logger.warning(f"Ignoring {env_key}, it is not valid JSON: {e}")
+    val = file_config.get(config_key)
+    if isinstance(val, list):
+        return val
+    return default
+
+def get_config_dict(env_key: str, config_key: str, default: dict, env: Optional[Mapping[str, str]] = None) -> dict:
+    env = os.environ if env is None else env
+    val = env.get(env_key)
     if val:
         try:
             return json.loads(val)
         except json.JSONDecodeError:
             pass
-    if config_key in file_config and isinstance(file_config[config_key], dict):
-        return file_config[config_key]
+    val = file_config.get(config_key)
+    if isinstance(val, dict):
+        return val
     return default
 
 # Configuration Class
 # Settings are resolved with the following priority (highest to lowest):
 # 1. Environment Variables (e.g., set in .env or Docker environment)
 # 2. Config File (values loaded from the external JSON configuration file)
-# 3. Default Values (defaults provided in the Field definitions below)
+# 3. Default Values (defaults provided in the field definitions below)
+# Resolution happens once in get_settings(), see SETTINGS_SOURCES for the env/config keys of each field.
 class Settings(BaseModel):
+    # Settings are a process-wide cached singleton, see get_settings()
+    model_config = ConfigDict(frozen=True)
+
     # Agent & API Configuration
-    mcp_url: str = Field(default_factory=lambda: get_config_value("MCP_SERVER_URL", "mcp_server_url", "http://localhost:80/mcp/sse"))
-    llm_provider: str = Field(default_factory=lambda: get_config_value("LLM_PROVIDER", "llm_provider", "openai").lower()) # "openai" or "mistral" or "ollama"
+    mcp_url: str = "http://localhost:80/mcp/sse"
+    llm_provider: str = "openai" # "openai" or "mistral" or "ollama"
     
     # OpenAI Settings
-    openai_api_key: str = Field(default_factory=lambda: get_config_value("OPENAI_API_KEY", "openai_api_key", None))
-    openai_endpoint: str = Field(default_factory=lambda: get_config_value("OPENAI_ENDPOINT", "openai_endpoint", None))
-    openai_model: str = Field(default_factory=lambda: get_config_value("OPENAI_MODEL", "openai_model", "gpt-4.1"))
+    openai_api_key: Optional[str] = None
+    openai_endpoint: Optional[str] = None
+    openai_model: str = "gpt-4.1"
 
     # Mistral Settings
-    mistral_api_key: str = Field(default_factory=lambda: get_config_value("MISTRAL_API_KEY", "mistral_api_key", None))
-    mistral_model: str = Field(default_factory=lambda: get_config_value("MISTRAL_MODEL", "mistral_model", "ministral-14b-2512"))
-    mistral_endpoint: Optional[str] = Field(default_factory=lambda: get_config_value("MISTRAL_ENDPOINT", "mistral_endpoint", None))
+    mistral_api_key: Optional[str] = None
+    mistral_model: str = "ministral-14b-2512"
+    mistral_endpoint: Optional[str] = None
     
     # Vector DB & Embeddings
-    vector_store_type: str = Field(default_factory=lambda: get_config_value("VECTOR_STORE_TYPE", "vector_store_type", "memory_embedding")) # "qdrant" or "memory" or "memory_embedding"
-    docs_collection_name: str = Field(default_factory=lambda: get_config_value("DOCS_COLLECTION_NAME", "docs_collection_name", "sparql_endpoint_docs"))
-    embedding_model: str = Field(default_factory=lambda: get_config_value("EMBEDDING_MODEL", "embedding_model", "embeddinggemma")) # change as needed to any model supported by the provider
-    embedding_provider: str = Field(default_factory=lambda: get_config_value("EMBEDDING_PROVIDER", "embedding_provider", "ollama")) # "fastembed" or "ollama"
-    embedding_dimensions: int = Field(default_factory=lambda: get_config_int("EMBEDDING_DIMENSIONS", "embedding_dimensions", "768")) # e.g., 768 for embeddinggemma, adjust as needed
+    vector_store_type: str = "memory_embedding" # "qdrant" or "memory" or "memory_embedding"
+    docs_collection_name: str = "sparql_endpoint_docs"
+    embedding_model: str = "embeddinggemma" # change as needed to any model supported by the provider
+    embedding_provider: str = "ollama" # "fastembed" or "ollama"
+    embedding_dimensions: int = 768 # e.g., 768 for embeddinggemma, adjust as needed
+    quantize_embeddings: bool = False # store in-memory embeddings as int8 (memory_embedding store only)
+    cache_dir: Optional[str] = None # directory caching the in-memory embeddings between restarts, disabled when unset
     
-    ollama_host: str = Field(default_factory=lambda: get_config_value("OLLAMA_HOST", "ollama_host", "http://localhost:11434"))
-    ollama_model: str = Field(default_factory=lambda: get_config_value("OLLAMA_MODEL", "ollama_model", "mistral-nemo"))
+    ollama_host: str = "http://localhost:11434"
+    ollama_model: str = "mistral-nemo"
 
-    qdrant_host: str = Field(default_factory=lambda: get_config_value("QDRANT_HOST", "qdrant_host", "localhost"))
-    qdrant_port: int = Field(default_factory=lambda: get_config_int("QDRANT_PORT", "qdrant_port", "6333"))
+    qdrant_host: str = "localhost"
+    qdrant_port: int = 6333
+    qdrant_quantization: str = "scalar" # "scalar" (int8), "binary" or "none", applied when the collection is created
     
-    default_number_of_retrieved_docs: int = Field(default_factory=lambda: get_config_int("DEFAULT_RETRIEVED_DOCS", "default_number_of_retrieved_docs", "3"))
-    similarity_threshold: float = Field(default_factory=lambda: get_config_float("SIMILARITY_THRESHOLD", "similarity_threshold", "0.5"))
-    force_index: bool = Field(default_factory=lambda: get_config_bool("FORCE_INDEX", "force_index", "false"))
-    auto_init: bool = Field(default_factory=lambda: get_config_bool("AUTO_INIT", "auto_init", "true"))
-    temperature: float = Field(default_factory=lambda: get_config_float("TEMPERATURE", "temperature", "0.0"))
-    llm_max_retries: int = Field(default_factory=lambda: get_config_int("LLM_MAX_RETRIES", "llm_max_retries", "3"))
+    default_number_of_retrieved_docs: int = 3
+    search_workers: int = 4 # threads serving knowledge base searches for the MCP tools
+    similarity_threshold: float = 0.5
+    force_index: bool = False
+    auto_init: bool = True
+    temperature: float = 0.0
+    llm_max_retries: int = 3
+    agent_run_timeout: int = 300 # seconds one agent run (all its LLM and tool calls) may take
+    llm_concurrency: int = 4 # entities of one task linked concurrently
 
     # Legacy Tools Settings
-    enable_legacy_tools: bool = Field(default_factory=lambda: get_config_bool("ENABLE_LEGACY_TOOLS", "enable_legacy_tools", "false"))
-    nominatim_endpoint: str = Field(default_factory=lambda: get_config_value("NOMINATIM_ENDPOINT", "nominatim_endpoint", "https://nominatim.openstreetmap.org/"))
+    enable_legacy_tools: bool = False
+    nominatim_endpoint: str = "https://nominatim.openstreetmap.org/"
+    tool_cache_size: int = 10000 # geocoding / web search responses kept in memory, 0 disables the cache
+    tool_cache_ttl: int = 86400 # seconds before a cached geocoding / web search response is refreshed
     
     # Agent Tools Configuration
-    enabled_tools: Optional[List[str]] = Field(default_factory=lambda: get_config_list("ENABLED_TOOLS", "enabled_tools", "search_location, search_sparql_docs, execute_sparql_query")) # comma-separated list of enabled tools for the agent, e.g., "search_location,search_web"
+    enabled_tools: Optional[List[str]] = ["search_location", "search_sparql_docs", "execute_sparql_query"] # comma-separated list of enabled tools for the agent, e.g., "search_location,search_web"
     
     #Stack configuration
-    mu_sparql_endpoint: str = Field(default_factory=lambda: get_config_value("MU_SPARQL_ENDPOINT", "mu_sparql_endpoint", "http://virtuoso:8890/sparql"))
+    mu_sparql_endpoint: str = "http://virtuoso:8890/sparql"
+    mu_sparql_updatepoint: Optional[str] = None # endpoint for SPARQL updates, defaults to mu_sparql_endpoint
+    sparql_pool_size: int = 32 # triplestore connections shared by the sync query()/update() callers (worker threads)
+    query_cache_size: int = 1024 # triplestore read queries cached when issued with cache=True, 0 disables the cache
+    query_cache_ttl: int = 60 # seconds a cached triplestore read stays valid
+    debug_endpoints: bool = False # expose /debug/pool with triplestore pool and cache stats, keep off in production
+    warm_queries: List[str] = [] # read queries run once at startup to fill the query cache, JSON array in WARM_QUERIES
+
+    # Task processing
+    task_batch_size: int = 10 # scheduled tasks fetched per polling query
+    max_parallel_tasks: int = 4 # tasks executed concurrently
 
     def get_llm_config(self):
         """Returns the API Key, Endpoint, and Model based on the selected provider."""
@@ -122,15 +175,79 @@ class Settings(BaseModel):
         else:
             return self.openai_api_key, self.openai_endpoint, self.openai_model
     
-    linking_job_type: str = Field(default_factory=lambda: get_config_value("LINKING_JOB_TYPE", "linking_job_type", "http://lblod.data.gift/id/jobs/concept/JobType/entity-linking"))
+    linking_job_type: str = "http://lblod.data.gift/id/jobs/concept/JobType/entity-linking"
 
-    resource_base: str = Field(default_factory=lambda: get_config_value("RESOURCE_BASE", "resource_base", "http://data.lblod.info/id/"))
+    resource_base: str = "http://data.lblod.info/id/"
 
-    default_graph: str = Field(default_factory=lambda: get_config_value("DEFAULT_GRAPH", "default_graph", "http://mu.semte.ch/graphs/harvesting"))   
-    publication_graph: str = Field(default_factory=lambda: get_config_value("PUBLICATION_GRAPH", "publication_graph", "http://mu.semte.ch/graphs/public/pdf"))    
+    default_graph: str = "http://mu.semte.ch/graphs/harvesting"
+    publication_graph: str = "http://mu.semte.ch/graphs/public/pdf"
 
     # Provenance configuration for NEL annotations
-    nel_agent_uri: str = Field(default_factory=lambda: get_config_value("NEL_AGENT_URI", "nel_agent_uri", "http://data.lblod.info/id/ai-components/linking"))
+    nel_agent_uri: str = "http://data.lblod.info/id/ai-components/linking"
+
+# (field name, env variable, config file key, resolver)
+SETTINGS_SOURCES = (
+    ("mcp_url", "MCP_SERVER_URL", "mcp_server_url", get_config_str),
+    ("llm_provider", "LLM_PROVIDER", "llm_provider", get_config_lower),
+    ("openai_api_key", "OPENAI_API_KEY", "openai_api_key", get_config_str),
+    ("openai_endpoint", "OPENAI_ENDPOINT", "openai_endpoint", get_config_str),
+    ("openai_model", "OPENAI_MODEL", "openai_model", get_config_str),
+    ("mistral_api_key", "MISTRAL_API_KEY", "mistral_api_key", get_config_str),
+    ("mistral_model", "MISTRAL_MODEL", "mistral_model", get_config_str),
+    ("mistral_endpoint", "MISTRAL_ENDPOINT", "mistral_endpoint", get_config_str),
+    ("vector_store_type", "VECTOR_STORE_TYPE", "vector_store_type", get_config_str),
+    ("docs_collection_name", "DOCS_COLLECTION_NAME", "docs_collection_name", get_config_str),
+    ("embedding_model", "EMBEDDING_MODEL", "embedding_model", get_config_str),
+    ("embedding_provider", "EMBEDDING_PROVIDER", "embedding_provider", get_config_str),
+    ("embedding_dimensions", "EMBEDDING_DIMENSIONS", "embedding_dimensions", get_config_int),
+    ("quantize_embeddings", "QUANTIZE_EMBEDDINGS", "quantize_embeddings", get_config_bool),
+    ("cache_dir", "CACHE_DIR", "cache_dir", get_config_str),
+    ("ollama_host", "OLLAMA_HOST", "ollama_host", get_config_str),
+    ("ollama_model", "OLLAMA_MODEL", "ollama_model", get_config_str),
+    ("qdrant_host", "QDRANT_HOST", "qdrant_host", get_config_str),
+    ("qdrant_port", "QDRANT_PORT", "qdrant_port", get_config_int),
+    ("qdrant_quantization", "QDRANT_QUANTIZATION", "qdrant_quantization", get_config_lower),
+    ("default_number_of_retrieved_docs", "DEFAULT_RETRIEVED_DOCS", "default_number_of_retrieved_docs", get_config_int),
+    ("search_workers", "SEARCH_WORKERS", "search_workers", get_config_int),
+    ("similarity_threshold", "SIMILARITY_THRESHOLD", "similarity_threshold", get_config_float),
+    ("force_index", "FORCE_INDEX", "force_index", get_config_bool),
+    ("auto_init", "AUTO_INIT", "auto_init", get_config_bool),
+    ("temperature", "TEMPERATURE", "temperature", get_config_float),
+    ("llm_max_retries", "LLM_MAX_RETRIES", "llm_max_retries", get_config_int),
+    ("agent_run_timeout", "AGENT_RUN_TIMEOUT", "agent_run_timeout", get_config_int),
+    ("llm_concurrency", "LLM_CONCURRENCY", "llm_concurrency", get_config_int),
+    ("enable_legacy_tools", "ENABLE_LEGACY_TOOLS", "enable_legacy_tools", get_config_bool),
+    ("nominatim_endpoint", "NOMINATIM_ENDPOINT", "nominatim_endpoint", get_config_str),
+    ("tool_cache_size", "TOOL_CACHE_SIZE", "tool_cache_size", get_config_int),
+    ("tool_cache_ttl", "TOOL_CACHE_TTL", "tool_cache_ttl", get_config_int),
+    ("enabled_tools", "ENABLED_TOOLS", "enabled_tools", get_config_list),
+    ("mu_sparql_endpoint", "MU_SPARQL_ENDPOINT", "mu_sparql_endpoint", get_config_str),
+    ("mu_sparql_updatepoint", "MU_SPARQL_UPDATEPOINT", "mu_sparql_updatepoint", get_config_str),
+    ("sparql_pool_size", "SPARQL_POOL_SIZE", "sparql_pool_size", get_config_int),
+    ("query_cache_size", "QUERY_CACHE_SIZE", "query_cache_size", get_config_int),
+    ("query_cache_ttl", "QUERY_CACHE_TTL", "query_cache_ttl", get_config_int),
+    ("debug_endpoints", "DEBUG_ENDPOINTS", "debug_endpoints", get_config_bool),
+    ("warm_queries", "WARM_QUERIES", "warm_queries", get_config_json_list),
+    ("task_batch_size", "TASK_BATCH_SIZE", "task_batch_size", get_config_int),
+    ("max_parallel_tasks", "MAX_PARALLEL_TASKS", "max_parallel_tasks", get_config_int),
+    ("linking_job_type", "LINKING_JOB_TYPE", "linking_job_type", get_config_str),
+    ("resource_base", "RESOURCE_BASE", "resource_base", get_config_str),
+    ("default_graph", "DEFAULT_GRAPH", "default_graph", get_config_str),
+    ("publication_graph", "PUBLICATION_GRAPH", "publication_graph", get_config_str),
+    ("nel_agent_uri", "NEL_AGENT_URI", "nel_agent_uri", get_config_str),
+)
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Build the Settings once from a single snapshot of the environment.
+    """
+    env = dict(os.environ)
+    resolved = {
+        field: resolver(env_key, config_key, Settings.model_fields[field].default, env)
+        for field, env_key, config_key, resolver in SETTINGS_SOURCES
+    }
+    return Settings(**resolved)
 
 class TaskOperations(str, Enum):
     NAMED_ENTITY_LINKING = "http://lblod.data.gift/id/jobs/concept/TaskOperation/named-entity-linking"
@@ -141,7 +258,7 @@ class TaskStatus(str, Enum):
     SUCCESS = "http://redpencil.data.gift/id/concept/JobStatus/success"
     FAILED = "http://redpencil.data.gift/id/concept/JobStatus/failed"
 
-settings = Settings()
+settings = get_settings()
 
 # Endpoints configuration
 endpoints = []
@@ -194,4 +311,20 @@ if not entity_class_configs:
         }
     }
 
-qdrant_client = QdrantClient(host=settings.qdrant_host, port=settings.qdrant_port)
+@lru_cache(maxsize=1)
+def get_qdrant_client():
+    """Create the Qdrant client on first use, so importing the config doesn't open a connection."""
+    from qdrant_client import QdrantClient
+    return QdrantClient(host=settings.qdrant_host, port=settings.qdrant_port)
+
+@lru_cache(maxsize=1)
+def get_prefixes_and_schema():
+    """Fetch the prefixes map and VoID schema of the configured endpoints once per process."""
+    from sparql_llm.utils import get_prefixes_and_schema_for_endpoints
+    return get_prefixes_and_schema_for_endpoints(endpoints)
+
+def __getattr__(name: str) -> Any:
+    # Keep `from config.config import qdrant_client` working, resolved lazily
+    if name == "qdrant_client":
+        return get_qdrant_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
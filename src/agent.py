@@ -1,6 +1,12 @@
 import asyncio
+import functools
+import threading
+from functools import lru_cache
+from types import MappingProxyType
 from typing import Any, Dict, List, Optional, Type, Union
 
+import httpx
+import orjson
 from click import prompt
 from fastapi import HTTPException
 from fastmcp import Client
@@ -10,42 +16,71 @@ from langchain_mistralai import ChatMistralAI
 from langchain_ollama import ChatOllama
 from langchain.agents import create_agent
 from langchain_core.messages import HumanMessage
-from pydantic import BaseModel, Field, create_model
+from pydantic import BaseModel, ConfigDict, Field, create_model
 
 # Clean logging
 from helpers import logger
 
 
+# --- Background Event Loop ---
+
+# Timeout (seconds) for a single LLM HTTP request and for sync tool invocations
+REQUEST_TIMEOUT = 120.0
+# Budget (seconds) for a whole agent run, which makes several LLM and tool calls
+RUN_TIMEOUT = 300.0
+TOOL_CALL_TIMEOUT = REQUEST_TIMEOUT
+
+# Long-lived loop used to run MCP calls from synchronous (LangChain sync) callers
+_bg_loop = asyncio.new_event_loop()
+threading.Thread(target=_bg_loop.run_forever, name="mcp-tools-loop", daemon=True).start()
+
+async def _on_bg_loop(coro):
+    """Run a coroutine on the background loop and await its result from any loop."""
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, _bg_loop))
+
+# Serializes (re)connecting the shared MCP session, only used on the background loop
+_connect_lock = asyncio.Lock()
+
+async def _ensure_connected(client: Client) -> None:
+    """Open the shared MCP session if it isn't open (anymore), once for all concurrent callers."""
+    if client.is_connected():
+        return
+    async with _connect_lock:
+        if not client.is_connected():
+            await client.__aenter__()
+
+async def _call_tool(client: Client, name: str, arguments: Dict[str, Any]):
+    """Call a tool on the shared MCP session, reconnecting it first if it was closed."""
+    await _ensure_connected(client)
+    return await client.call_tool(name, arguments)
+
 # --- Helper Functions ---
 
+# JSON schema type -> Python type
+_TYPE_MAP = MappingProxyType({
+    "string": str,
+    "integer": int,
+    "number": float,
+    "boolean": bool,
+    "object": dict,
+    "array": list,
+    "null": type(None),
+})
+
 def json_schema_to_pydantic(schema: Dict[str, Any], model_name: str) -> Type[BaseModel]:
     """Helper to convert a JSON schema to a Pydantic model dynamically."""
     fields = {}
     if not schema or "properties" not in schema:
         return create_model(model_name)
     
-    required = set(schema.get("required", []))
-    
-    type_map = {
-        "string": str,
-        "integer": int,
-        "number": float,
-        "boolean": bool,
-        "object": dict,
-        "array": list,
-        "null": type(None),
-    }
+    required = frozenset(schema.get("required") or ())
 
     for name, prop in schema.get("properties", {}).items():
         json_type = prop.get("type")
         
         # Handle anyOf (e.g. for Optional/Nullable types)
-        if not json_type and "anyOf" in prop:
-             for option in prop["anyOf"]:
-                  t = option.get("type")
-                  if t and t != "null":
-                       json_type = t
-                       break
+        if not json_type:
+            json_type = next((o["type"] for o in prop.get("anyOf", ()) if o.get("type") and o["type"] != "null"), None)
 
         if isinstance(json_type, list):
              json_type = json_type[0]
@@ -61,10 +96,10 @@ def json_schema_to_pydantic(schema: Dict[str, Any], model_name: str) -> Type[Bas
             
             # recursive or simple? assuming simple for tools
             # Python < 3.9 List[T], >= 3.9 list[T]. usage of List from typing is safer compatibility
-            item_type = type_map.get(item_type_str, Any)
+            item_type = _TYPE_MAP.get(item_type_str, Any)
             p_type = List[item_type]
         else:
-            p_type = type_map.get(json_type, Any)
+            p_type = _TYPE_MAP.get(json_type, Any)
         
         # Helper to determine if nullable
         # (Simplified logic, assumes if not required it is optional)
@@ -79,35 +114,44 @@ def json_schema_to_pydantic(schema: Dict[str, Any], model_name: str) -> Type[Bas
         
     return create_model(model_name, **fields)
 
+@lru_cache(maxsize=256)
+def _schema_to_model_cached(model_name: str, schema_json: str) -> Type[BaseModel]:
+    """Cached json_schema_to_pydantic, keyed on the tool name and its canonical schema JSON."""
+    return json_schema_to_pydantic(orjson.loads(schema_json), model_name)
+
 def create_mcp_tool(tool_info, client, verbose: bool = False):
     """Creates a LangChain Tool from an MCP tool definition."""
     schema = getattr(tool_info, "inputSchema", {})
     # Only create model if there are properties, else None (or empty model)
     if schema and "properties" in schema:
-        pydantic_model = json_schema_to_pydantic(schema, tool_info.name)
+        schema_key = orjson.dumps(schema, option=orjson.OPT_SORT_KEYS).decode()
+        pydantic_model = _schema_to_model_cached(tool_info.name, schema_key)
     else:
         pydantic_model = None
 
     async def _acall(**kwargs):
         if verbose:
             logger.info(f"Invoking tool {tool_info.name} with args: {kwargs}")
-        async with client:
-            result = await client.call_tool(tool_info.name, kwargs)
-            # Extract text content if possible
-            if hasattr(result, "content") and isinstance(result.content, list):
-                text_content = []
-                for item in result.content:
-                    if hasattr(item, "text"):
-                        text_content.append(item.text)
-                    elif isinstance(item, dict) and "text" in item:
-                        text_content.append(item["text"])
-                if text_content:
-                    return "\n".join(text_content)
+        # The MCP session lives on the background loop, see Agent.initialize
+        result = await _on_bg_loop(_call_tool(client, tool_info.name, kwargs))
+        # Extract text content if possible
+        if hasattr(result, "content") and isinstance(result.content, list):
+            text_content = "\n".join(
+                item.text if hasattr(item, "text") else item["text"]
+                for item in result.content
+                if hasattr(item, "text") or (isinstance(item, dict) and "text" in item)
+            )
+            if text_content:
+                return text_content
+        try:
+            return orjson.dumps(result, default=str).decode()
+        except TypeError:
             return str(result)
 
     def _call(**kwargs):
-        # Sync wrapper not recommended for async usage but needed for LC sync methods
-        return asyncio.run(_acall(**kwargs))
+        # Sync wrapper not recommended for async usage but needed for LC sync methods.
+        # Runs on the shared background loop instead of spinning up a new loop per call.
+        return asyncio.run_coroutine_threadsafe(_acall(**kwargs), _bg_loop).result(timeout=TOOL_CALL_TIMEOUT)
 
     return StructuredTool.from_function(
         func=_call,
@@ -120,15 +164,21 @@ def create_mcp_tool(tool_info, client, verbose: bool = False):
 # --- Response Models ---
 
 class SparqlResult(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     uri: str = Field(..., description="The URI of the entity")
     label: str = Field(..., description="The label of the entity")
     location: Optional[str] = Field(None, description="The location associated with the entity.")
     reasoning: str = Field(..., description="The reasoning behind the selection.")
 
 class SparqlResponse(BaseModel):
+    model_config = ConfigDict(frozen=True, extra="ignore")
+
     results: List[SparqlResult] = Field(..., description="The list of matching entities found")
 
 class AgentConfig(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     mcp_server_url: str
     provider: str = "openai"  # or "mistral"
     api_key: Optional[str] = None # Not needed for Ollama
@@ -139,39 +189,69 @@ class AgentConfig(BaseModel):
     enabled_tools: Optional[List[str]] = None
     entity_class_configs: Optional[Dict[str, Any]] = None
     llm_max_retries: int = 3
+    request_timeout: float = REQUEST_TIMEOUT
+    run_timeout: float = RUN_TIMEOUT
 
 # --- Agent Class ---
 
+# Default fallback template for structured requests
+DEFAULT_QUERY_TEMPLATE = """Write a SPARQL query to find the URI of the {classification_class} {entity_label} in region {location}, execute it and return the results.
+        Keep iterating until you find the best possible match. Provide reasoning for your selection."""
+
+@lru_cache(maxsize=8)
+def _build_llm(provider: str, model: str, api_key: Optional[str], endpoint: Optional[str], temperature: float, max_retries: int, timeout: float):
+    """Creates the chat model for a provider; cached so identical configs share one HTTP connection pool."""
+    # Deadline enforced on the socket itself, so a timed out request is torn down instead of left running
+    http_timeout = httpx.Timeout(timeout, connect=5.0)
+    if provider == "mistral":
+        kwargs = {
+            "model": model,
+            "api_key": api_key,
+            "temperature": temperature,
+            "max_retries": max_retries,
+            "timeout": int(timeout)
+        }
+        if endpoint:
+            kwargs["base_url"] = endpoint
+            
+        return ChatMistralAI(**kwargs)
+    elif provider == "ollama":
+        return ChatOllama(
+            model=model,
+            base_url=endpoint, # Maps to ollama_url
+            temperature=temperature,
+            client_kwargs={"timeout": http_timeout}
+        )
+    else:   
+        return ChatOpenAI(
+            model=model,
+            api_key=api_key,
+            base_url=endpoint,
+            temperature=temperature,
+            timeout=http_timeout
+        )
+
 class Agent:
     def __init__(self, config: AgentConfig):
         self.config = config
         self.mcp_client = Client(config.mcp_server_url)
+        # The agent is shared by concurrent requests and tasks, only the first caller connects and builds it
+        self._init_lock = asyncio.Lock()
+        # Agents built for a subset of the tools, keyed on the tool names
+        self._subset_agents: Dict[frozenset, Any] = {}
+        # Entity class configs keyed on the lower-cased class, looked up on every structured request
+        self.entity_class_mapping = {k.lower(): v for k, v in (config.entity_class_configs or {}).items()}
         
-        # Initialize LLM
-        if self.config.provider.lower() == "mistral":
-            kwargs = {
-                "model": self.config.model,
-                "api_key": self.config.api_key,
-                "temperature": self.config.temperature,
-                "max_retries": self.config.llm_max_retries
-            }
-            if self.config.endpoint:
-                kwargs["base_url"] = self.config.endpoint
-                
-            self.llm = ChatMistralAI(**kwargs)
-        elif self.config.provider.lower() == "ollama":
-            self.llm = ChatOllama(
-                model=self.config.model,
-                base_url=self.config.endpoint, # Maps to ollama_url
-                temperature=self.config.temperature
-            )
-        else:   
-            self.llm = ChatOpenAI(
-                model=self.config.model,
-                api_key=self.config.api_key,
-                base_url=self.config.endpoint,
-                temperature=self.config.temperature
-            )
+        # Initialize LLM (shared across agents with an identical configuration)
+        self.llm = _build_llm(
+            self.config.provider.lower(),
+            self.config.model,
+            self.config.api_key,
+            self.config.endpoint,
+            self.config.temperature,
+            self.config.llm_max_retries,
+            self.config.request_timeout,
+        )
 
     async def get_tools(self):
         """Returns the list of tools available to the agent."""
@@ -180,25 +260,34 @@ class Agent:
         return self.lc_tools
 
     async def initialize(self):
-        """Connects to MCP, loads tools, and builds the agent."""
+        """Connects to MCP, loads tools, and builds the agent. No-op once initialized."""
+        async with self._init_lock:
+            if hasattr(self, 'cached_tools'):
+                return
+            await self._initialize()
+
+    async def _initialize(self):
         try:
             logger.info(f"Connecting to MCP at {self.config.mcp_server_url}")
-            async with self.mcp_client:
-                tools_info = await self.mcp_client.list_tools()
-                logger.info(f"Found {len(tools_info)} tools")
+            # Open the MCP session once and keep it for all subsequent tool calls
+            await _on_bg_loop(_ensure_connected(self.mcp_client))
+            tools_info = await _on_bg_loop(self.mcp_client.list_tools())
+            logger.info(f"Found {len(tools_info)} tools")
             
             # Filter tools if enabled_tools is set
             if self.config.enabled_tools is not None:
                 tools_info = [t for t in tools_info if t.name in self.config.enabled_tools]
                 logger.info(f"Filtered to {len(tools_info)} tools: {[t.name for t in tools_info]}")
 
-            # Convert to LangChain tools
-            self.lc_tools = [create_mcp_tool(t, self.mcp_client, verbose=self.config.verbose) for t in tools_info]
+            # Convert to LangChain tools (off the event loop, model building is CPU-bound)
+            self.lc_tools = list(await asyncio.gather(
+                *[asyncio.to_thread(create_mcp_tool, t, self.mcp_client, self.config.verbose) for t in tools_info]
+            ))
             self.cached_tools = {t.name: t for t in self.lc_tools}
             
 
-            # We use tool calling agent
-            self.agent = create_agent(self.llm, tools=self.lc_tools, response_format=SparqlResponse)
+            # We use tool calling agent, built in an executor so startup doesn't block the event loop
+            self.agent = await self._build_agent(self.lc_tools)
 
             logger.info("Agent initialized successfully")
             
@@ -206,30 +295,46 @@ class Agent:
             logger.error(f"Failed to initialize agent: {e}")
             raise e
 
+    async def _build_agent(self, tools: list):
+        """Build a tool calling agent in an executor, create_agent is too heavy for the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(
+            None, functools.partial(create_agent, self.llm, tools=tools, response_format=SparqlResponse)
+        )
+
+    async def _agent_for(self, specific_tools: Optional[List[str]]):
+        """The agent for the given tool names, built once per tool subset. None means all enabled tools."""
+        if specific_tools is None:
+            return self.agent
+        tools_to_use = [self.cached_tools[name] for name in specific_tools if name in self.cached_tools]
+        if not tools_to_use:
+            logger.warning("No tools available for this request.")
+        key = frozenset(t.name for t in tools_to_use)
+        agent = self._subset_agents.get(key)
+        if agent is None:
+            # Concurrent first requests may both build it, the agents are equivalent
+            agent = self._subset_agents[key] = await self._build_agent(tools_to_use)
+        return agent
+
+    async def aclose(self):
+        """Closes the MCP session opened by initialize()."""
+        if self.mcp_client.is_connected():
+            await _on_bg_loop(self.mcp_client.__aexit__(None, None, None))
+
     async def _run_request(self, query: str, specific_tools: Optional[List[str]] = None) -> SparqlResponse:
         """Internal method to run a query with optionally specific tools JIT."""
         if not hasattr(self, 'cached_tools'):
             await self.initialize()
 
-        # Determine which tools to use for this request
-        if specific_tools is not None:
-            tools_to_use = [self.cached_tools[name] for name in specific_tools if name in self.cached_tools]
-        else:
-            tools_to_use = self.lc_tools
-
-        if not tools_to_use:
-            logger.warning("No tools available for this request.")
-
-        # JIT Agent Creation (lightweight operation)
-        temp_agent = create_agent(self.llm, tools=tools_to_use, response_format=SparqlResponse)
+        agent = await self._agent_for(specific_tools)
 
         try:
-            # Use ainvoke (async) with asyncio.wait_for to enforce a strict timeout
+            # request_timeout only bounds each LLM HTTP call (enforced by the clients on the socket).
+            # The whole run is cut off by this wait_for after run_timeout, cancelling its pending calls.
             result = await asyncio.wait_for(
-                temp_agent.ainvoke(
+                agent.ainvoke(
                     {"messages": [{"role": "user", "content": query}]}
                 ),
-                timeout=120.0 # Timeout in seconds
+                timeout=self.config.run_timeout
             )
 
             if isinstance(result, dict) and "structured_response" in result:
@@ -257,7 +362,7 @@ class Agent:
                  raise ValueError(error_msg)
 
         except asyncio.TimeoutError:
-            raise HTTPException(status_code=408, detail="Operation timed out after 120 seconds")
+            raise HTTPException(status_code=408, detail=f"Operation timed out after {self.config.run_timeout:g} seconds")
         
         except Exception as e:
             logger.error(f"Error in sparql request: {e}")
@@ -276,16 +381,13 @@ class Agent:
 
     async def run_sparql_request_structured(self, entity_class: str, entity_label: str, location: str = "N/A") -> SparqlResponse:
         """Specific method to run the SPARQL finding task and return structured data based on structured inputs."""
-      
-        # Default fallback template
-        query_template = """Write a SPARQL query to find the URI of the {classification_class} {entity_label} in region {location}, execute it and return the results.
-        Keep iterating until you find the best possible match. Provide reasoning for your selection."""
+        query_template = DEFAULT_QUERY_TEMPLATE
         
         # Determine specific tools and query based on entity class mapping
         specific_tools = None
-        if self.config.entity_class_configs:
+        if self.entity_class_mapping:
             class_key = entity_class.lower()
-            mapping = {k.lower(): v for k, v in self.config.entity_class_configs.items()}
+            mapping = self.entity_class_mapping
             logger.info(f"Looking for specific tool configuration for class '{class_key}' in mapping: {mapping.keys()}")
             if class_key in mapping:
                 conf = mapping[class_key]
@@ -1,34 +1,66 @@
 import asyncio
 import contextlib
 from typing import AsyncIterator
-from pydantic import BaseModel
 from src.job import process_open_tasks, startup_tasks
 
-from fastapi import FastAPI, APIRouter, BackgroundTasks
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 
-from src.mcp_server import mcp
+from src.mcp_server import mcp, aclose_http_clients as aclose_mcp_http_clients
+from src.utils import triplestore
+from config.config import settings
 from src.agent import Agent, SparqlResponse
 
 # Setup logging
 from helpers import logger
-from src.utils.utils import initialize_agent
+from src.utils.utils import initialize_agent, mcp_is_ready, start_queue_logging, stop_queue_logging
 
 # Global agent instance
 agent_instance: Agent = None
 
+# How long the agent warm-up waits for the mounted MCP server to answer
+MCP_READY_ATTEMPTS = 20
+MCP_READY_INTERVAL = 0.5
+
+async def _warm_up_agent(agent: Agent) -> None:
+    # The MCP server is served by this app, it only answers once uvicorn has bound its socket
+    for _ in range(MCP_READY_ATTEMPTS):
+        if await mcp_is_ready():
+            break
+        await asyncio.sleep(MCP_READY_INTERVAL)
+    else:
+        logger.warning("MCP server not ready, the agent will be initialized on first request")
+        return
+    try:
+        await agent.initialize()
+    except Exception as e:
+        logger.error(f"Agent warm-up failed, it will be initialized on first request: {e}")
+
 @contextlib.asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncIterator[None]:
     """FastAPI lifespan that initializes the MCP session manager and Agent."""
     global agent_instance
-    
+
+    # Log writes happen on a background thread from here on, request handlers only enqueue records
+    log_listener = start_queue_logging(logger)
+
     agent_instance = initialize_agent()
+    # Connect to MCP and build the agent eagerly so the first request doesn't pay for it.
+    # Scheduled as a task: the MCP server is mounted on this app and only answers once startup completes.
+    asyncio.create_task(_warm_up_agent(agent_instance))
 
     logger.info("Running startup tasks...")
     asyncio.create_task(startup_tasks())  # Start processing tasks in the background
     
     yield
 
+    if agent_instance:
+        await agent_instance.aclose()
+    await aclose_mcp_http_clients()
+    await triplestore.aclose()
+    stop_queue_logging(logger, log_listener)
+
 # Request Models
 class QueryRequest(BaseModel):
     query: str
@@ -38,8 +70,8 @@ class SparqlRequest(BaseModel):
     entity_label: str
     location: str = "N/A"
     
-# Initialize the router
-router = APIRouter()
+# Initialize the router (orjson encoding for all responses)
+router = APIRouter(default_response_class=ORJSONResponse)
 
 # Endpoints
 
@@ -50,44 +82,57 @@ async def run_request(request: QueryRequest):
          raise HTTPException(status_code=500, detail="Agent not initialized")
     return await agent_instance.run_query(request.query)
 
-@router.post("/agent/query_structured", response_model=SparqlResponse)
+@router.post("/agent/query_structured", responses={200: {"model": SparqlResponse}})
 async def run_sparql_request_structured(request: SparqlRequest):
     logger.info(f"Received structured query request: {request}")
     """Perform a structured entity linking via the agent."""
     if not agent_instance:
         raise HTTPException(status_code=500, detail="Agent not initialized")
-    return await agent_instance.run_sparql_request_structured(
+    result = await agent_instance.run_sparql_request_structured(
         entity_class=request.entity_class,
         entity_label=request.entity_label,
         location=request.location
     )
+    # The agent already returns a validated SparqlResponse, skip response_model re-validation
+    return ORJSONResponse(content=result.model_dump(mode="json"))
     
 @router.get("/")
 async def health():
     return {"status": "running", "endpoints": ["/mcp"]}
 
+if settings.debug_endpoints:
+    @router.get("/debug/pool")
+    async def debug_pool():
+        """Triplestore connection pool and read query cache usage."""
+        return {"pool": triplestore.pool_info(), "query_cache": triplestore.query_cache_info()}
+
+# Supported ways to obtain the MCP ASGI app, in order of preference (attribute name, factory, log description)
+_MCP_MOUNT_METHODS = (
+    ("streamable_http_app", lambda m: m.streamable_http_app(), "streamable_http_app()"),
+    # Current FastMCP version uses http_app method
+    ("http_app", lambda m: m.http_app(transport="sse"), "http_app(transport='sse')"),
+    # Some versions expose sse_app
+    ("sse_app", lambda m: m.sse_app, "sse_app"),
+    ("_sse_app", lambda m: m._sse_app, "_sse_app"),
+)
+# Resolved mount method, probed once per process
+_mcp_mount_method = None
+
 def mount_mcp(app: FastAPI):
     """Mounts the MCP server to the FastAPI app."""
     # Adapting from Swiss Sparql-llm github
+    global _mcp_mount_method
     try:
-        if hasattr(mcp, "streamable_http_app"):
-            app.mount("/mcp", mcp.streamable_http_app(), name="mcp")
-            logger.info("Mounted MCP via streamable_http_app()")
-        elif hasattr(mcp, "http_app"):
-            # Current FastMCP version uses http_app method
-            app.mount("/mcp", mcp.http_app(transport="sse"), name="mcp")
-            logger.info("Mounted MCP via http_app(transport='sse')")
-        elif hasattr(mcp, "sse_app"):
-            # Some versions expose sse_app
-            app.mount("/mcp", mcp.sse_app, name="mcp")
-            logger.info("Mounted MCP via sse_app")
-        elif hasattr(mcp, "_sse_app"):
-             app.mount("/mcp", mcp._sse_app, name="mcp")
-             logger.info("Mounted MCP via _sse_app")
-        else:
+        if _mcp_mount_method is None:
+            _mcp_mount_method = next((m for m in _MCP_MOUNT_METHODS if hasattr(mcp, m[0])), None)
+        if _mcp_mount_method is None:
             # If it's the raw FastMCP object and we can't find the app method
             # We might need to check if the user meant to use a specific adapter
             logger.warning("Could not find suitable mounting method for MCP object. /mcp endpoint might not be available.")
+            return
+        _name, factory, description = _mcp_mount_method
+        app.mount("/mcp", factory(mcp), name="mcp")
+        logger.info(f"Mounted MCP via {description}")
     except Exception as e:
         logger.error(f"Failed to mount MCP app: {e}")
 
@@ -1,4 +1,10 @@
-from typing import List, Iterable
+import asyncio
+import threading
+from collections import OrderedDict
+from itertools import islice
+from typing import Iterator, List, Tuple
+import httpx
+import numpy as np
 from fastembed import TextEmbedding
 
 try:
@@ -8,10 +14,23 @@ except ImportError:
 
 from helpers import logger
 
+# Connection pool limits for the async Ollama client
+OLLAMA_CONNECTION_LIMITS = httpx.Limits(max_keepalive_connections=20)
+
+# Number of query embeddings kept by EmbeddingModel.embed_queries
+QUERY_CACHE_SIZE = 4096
+
+def _batched(texts: List[str], batch_size: int) -> Iterator[List[str]]:
+    it = iter(texts)
+    while batch := list(islice(it, batch_size)):
+        yield batch
+
 class EmbeddingModel:
     def __init__(self, model_name: str, provider: str = "fastembed", base_url: str = None, **kwargs):
         self.provider = provider
         self.model_name = model_name
+        self._query_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._query_cache_lock = threading.Lock()
         
         if provider == "fastembed":
             # Using fastembed directly
@@ -19,15 +38,73 @@ class EmbeddingModel:
         elif provider == "ollama":
             if not OllamaEmbeddings:
                 raise ImportError("langchain-ollama is required for Ollama embeddings")
-            # Using generic Ollama wrapper
-            self.model = OllamaEmbeddings(model=model_name, base_url=base_url, **kwargs)
+            # Using generic Ollama wrapper, its async client keeps a keep-alive pool across requests
+            self.model = OllamaEmbeddings(
+                model=model_name,
+                base_url=base_url,
+                async_client_kwargs={"limits": OLLAMA_CONNECTION_LIMITS},
+                **kwargs,
+            )
         else:
             raise ValueError(f"Unknown provider: {provider}")
 
-    def embed(self, texts: List[str]) -> Iterable[List[float]]:
+    def embed(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Embed texts into a contiguous float32 array of shape (len(texts), dim)."""
         if self.provider == "fastembed":
-            return self.model.embed(texts)
-        elif self.provider == "ollama":
-            # OllamaEmbeddings.embed_documents returns List[List[float]]
-            return self.model.embed_documents(texts)
-        return []
+            vectors = self.model.passage_embed(texts, batch_size=batch_size)
+        else:
+            # OllamaEmbeddings.embed_documents returns List[List[float]], one request per batch
+            vectors = (vector for batch in _batched(texts, batch_size) for vector in self.model.embed_documents(batch))
+        # Fill a preallocated matrix row by row instead of materializing every vector first
+        embeddings = None
+        for i, vector in enumerate(vectors):
+            if embeddings is None:
+                embeddings = np.empty((len(texts), len(vector)), dtype=np.float32)
+            embeddings[i] = vector
+        return embeddings if embeddings is not None else np.empty((0, 0), dtype=np.float32)
+
+    def embed_queries(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed search queries, using the model's query-side encoding when it has one.
+
+        fastembed applies the model specific query instruction (e.g. the "query: " prefix of E5 models),
+        documents embedded with embed() get the matching passage encoding.
+        Recently embedded queries are served from an in-memory LRU cache, only the misses hit the model.
+        """
+        with self._query_cache_lock:
+            cached = {text: self._query_cache[text] for text in texts if text in self._query_cache}
+            for text in cached:
+                self._query_cache.move_to_end(text)
+
+        missing = [text for text in dict.fromkeys(texts) if text not in cached]
+        if missing:
+            if self.provider == "fastembed":
+                vectors = np.asarray(list(self.model.query_embed(missing, batch_size=batch_size)), dtype=np.float32)
+            else:
+                vectors = self.embed(missing, batch_size=batch_size)
+            with self._query_cache_lock:
+                for text, vector in zip(missing, vectors):
+                    cached[text] = self._query_cache[text] = vector
+                while len(self._query_cache) > QUERY_CACHE_SIZE:
+                    self._query_cache.popitem(last=False)
+
+        return np.asarray([cached[text] for text in texts], dtype=np.float32)
+
+    def embed_int8(self, texts: List[str], batch_size: int = 32) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Embed texts and quantize them to int8 with a symmetric per-dimension scale.
+
+        Returns:
+            The (N, dim) int8 vectors and the (dim,) float32 scale; `vectors * scale` dequantizes.
+        """
+        embeddings = self.embed(texts, batch_size=batch_size)
+        scale = np.max(np.abs(embeddings), axis=0) / 127.0
+        scale[scale == 0] = 1.0  # all-zero dimensions
+        return (embeddings / scale).round().astype(np.int8), scale.astype(np.float32)
+
+    async def aembed(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        """Async variant of embed() that doesn't block the event loop."""
+        if self.provider == "ollama":
+            results = await asyncio.gather(*[self.model.aembed_documents(batch) for batch in _batched(texts, batch_size)])
+            return np.asarray([embedding for result in results for embedding in result], dtype=np.float32)
+        return await asyncio.to_thread(self.embed, texts, batch_size)
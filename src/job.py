@@ -1,12 +1,12 @@
 import asyncio
-from string import Template
 import time
 
-from escape_helpers import sparql_escape_uri
-from helpers import logger, update, query
+from src.utils.escape import sparql_escape_uri
+from helpers import logger
+from src.utils.triplestore import aquery, query, update, warm_up
 
 from config.config import TaskOperations, settings, TaskStatus
-from src.utils.utils import get_prefixes_for_query, wait_for_triplestore
+from src.utils.utils import get_prefixes_for_query, mcp_is_ready, wait_for_triplestore
 from src.task import Task
 
 ############################################################
@@ -17,35 +17,25 @@ class TaskNotFoundException(Exception):
     "Raised when task is not found"
     pass
 
-async def startup_tasks():
-    wait_for_triplestore()
-    # on startup fail existing busy tasks
-    logger.info(f"Failing busy tasks open tasks...")
-    fail_busy_tasks()
-    logger.info(f"Processing open tasks...")
-    await asyncio.sleep(5)  # Give the MCP server time to be ready
-    await process_open_tasks()
-    logger.info(f"Processing open tasks finished")
+_DEFAULT_GRAPH_URI = sparql_escape_uri(settings.default_graph)
 
-def fail_busy_tasks():
-    logger.info("Startup: failing busy tasks if there are any")
-    update(f"""
+_FAIL_BUSY_SQL = f"""
       PREFIX mu: <http://mu.semte.ch/vocabularies/core/>
       PREFIX dct: <http://purl.org/dc/terms/>
       PREFIX adms: <http://www.w3.org/ns/adms#>
       PREFIX task: <http://redpencil.data.gift/vocabularies/tasks/>
       DELETE {{
-        GRAPH {sparql_escape_uri(settings.default_graph)} {{
+        GRAPH {_DEFAULT_GRAPH_URI} {{
             ?task  adms:status ?status
         }}
       }}
       INSERT {{
-        GRAPH {sparql_escape_uri(settings.default_graph)} {{
+        GRAPH {_DEFAULT_GRAPH_URI} {{
           ?task adms:status {sparql_escape_uri(TaskStatus.FAILED.value)}
         }}
       }}
       WHERE  {{
-        GRAPH {sparql_escape_uri(settings.default_graph)} {{
+        GRAPH {_DEFAULT_GRAPH_URI} {{
             ?task a task:Task .
             ?task dct:isPartOf ?job;
             task:operation ?operation ;
@@ -59,18 +49,18 @@ def fail_busy_tasks():
         }}
       }}
 
-        """, sudo=True)
+        """
 
-def load_task(subject, graph = settings.default_graph):
-    query_template = Template("""
+# Constant query text, the task and graph are bound in a trailing VALUES block
+_LOAD_TASK_SQL = """
   PREFIX mu: <http://mu.semte.ch/vocabularies/core/>
   PREFIX dct: <http://purl.org/dc/terms/>
   PREFIX adms: <http://www.w3.org/ns/adms#>
   PREFIX task: <http://redpencil.data.gift/vocabularies/tasks/>
   SELECT DISTINCT ?id ?job ?jobId ?created ?modified ?status ?index ?operation ?error WHERE {
-      GRAPH $graph {
-        $subject a task:Task .
-        $subject dct:isPartOf ?job;
+      GRAPH ?graph {
+        ?subject a task:Task .
+        ?subject dct:isPartOf ?job;
                       mu:uuid ?id;
                       dct:created ?created;
                       dct:modified ?modified;
@@ -78,16 +68,48 @@ def load_task(subject, graph = settings.default_graph):
                       task:index ?index;
                       task:operation ?operation.
         ?job mu:uuid ?jobId.
-        OPTIONAL { $subject task:error ?error. }
+        OPTIONAL { ?subject task:error ?error. }
       }
     }
+"""
 
-    """)
+_OPEN_TASKS_SQL = f"""
+        {get_prefixes_for_query("task", "adms")}
+        SELECT ?task WHERE {{
+        GRAPH {_DEFAULT_GRAPH_URI} {{
+            ?task adms:status {sparql_escape_uri(TaskStatus.SCHEDULED.value)} ;
+                  task:operation ?operation .
+            VALUES ?operation {{
+              {sparql_escape_uri(TaskOperations.NAMED_ENTITY_LINKING.value)}
+            }}
+        }}
+        }}
+        """
 
-    query_string = query_template.substitute(
-        graph = sparql_escape_uri(graph),
-        subject = sparql_escape_uri(subject)
-    )
+async def startup_tasks():
+    # The blocking triplestore calls run in a thread to keep the event loop serving requests
+    await asyncio.to_thread(wait_for_triplestore)
+    # on startup fail existing busy tasks
+    logger.info(f"Failing busy tasks open tasks...")
+    await asyncio.to_thread(fail_busy_tasks)
+    # After fail_busy_tasks, its update would clear the cache again
+    if settings.warm_queries:
+        await warm_up(settings.warm_queries)
+    logger.info(f"Processing open tasks...")
+    # Give the MCP server time to be ready, for at most 5 seconds
+    for _ in range(10):
+        if await mcp_is_ready():
+            break
+        await asyncio.sleep(0.5)
+    await process_open_tasks()
+    logger.info(f"Processing open tasks finished")
+
+def fail_busy_tasks():
+    logger.info("Startup: failing busy tasks if there are any")
+    update(_FAIL_BUSY_SQL, sudo=True)
+
+def load_task(subject, graph = settings.default_graph):
+    query_string = f"{_LOAD_TASK_SQL}VALUES (?graph ?subject) {{ ({sparql_escape_uri(graph)} {sparql_escape_uri(subject)}) }}\n"
 
     results = query(query_string, sudo=True)
     bindings = results["results"]["bindings"]
@@ -116,32 +138,50 @@ def load_task(subject, graph = settings.default_graph):
         raise Exception(f"Unexpected result loading task: {results}")
 
 
+# Only one poller runs at a time, a delta arriving meanwhile asks it for one more pass instead.
+# Two overlapping runs would fetch the same scheduled batch and execute its tasks twice.
+_poll_lock = asyncio.Lock()
+_rerun_requested = False
+
 async def process_open_tasks():
+    global _rerun_requested
+    if _poll_lock.locked():
+        logger.info("Task polling already running, requesting another pass")
+        _rerun_requested = True
+        return
+    async with _poll_lock:
+        while True:
+            _rerun_requested = False
+            await _process_open_tasks()
+            if not _rerun_requested:
+                break
+
+async def _process_open_tasks():
     logger.info("Checking for open tasks...")
-    uri = get_one_open_task()
-    while uri is not None:
-        logger.info(f"Processing {uri}")
-        task = Task.from_uri(uri)
-        logger.info(f"Loaded task {task.task_uri}")
-        await task.execute()
-        logger.info(f"Finished processing {uri}")
-        await asyncio.sleep(5)
-        uri = get_one_open_task()
-
-def get_one_open_task() -> str | None:
-    q = f"""
-        {get_prefixes_for_query("task", "adms")}
-        SELECT ?task WHERE {{
-        GRAPH <{settings.default_graph}> {{
-            ?task adms:status <{TaskStatus.SCHEDULED.value}> ;
-                  task:operation ?operation .
-            VALUES ?operation {{
-              {sparql_escape_uri(TaskOperations.NAMED_ENTITY_LINKING.value)}
-            }}
-        }}
-        }}
-        limit 1
-    """
-    results = query(q, sudo=True)
+    semaphore = asyncio.Semaphore(settings.max_parallel_tasks)
+
+    async def run_task(uri: str):
+        async with semaphore:
+            logger.info(f"Processing {uri}")
+            task = await Task.from_uri(uri)
+            logger.info(f"Loaded task {task.task_uri}")
+            await task.execute()
+            logger.info(f"Finished processing {uri}")
+
+    # Every delta starts a new run, so stop once no new scheduled tasks are left.
+    # Tasks that stay scheduled after a failure are not picked up again in this run.
+    attempted = set()
+    uris = await get_open_tasks(settings.task_batch_size)
+    while uris:
+        attempted.update(uris)
+        results = await asyncio.gather(*(run_task(uri) for uri in uris), return_exceptions=True)
+        for uri, result in zip(uris, results):
+            if isinstance(result, Exception):
+                logger.error(f"Task {uri} failed: {result}")
+        uris = [uri for uri in await get_open_tasks(settings.task_batch_size) if uri not in attempted]
+
+async def get_open_tasks(limit: int) -> list[str]:
+    q = f"{_OPEN_TASKS_SQL}LIMIT {limit}\n"
+    results = await aquery(q, sudo=True)
     bindings = results.get("results", {}).get("bindings", [])
-    return bindings[0]["task"]["value"] if bindings else None
\ No newline at end of file
+    return [b["task"]["value"] for b in bindings]
@@ -1,20 +1,67 @@
 from abc import ABC, abstractmethod
-import math
+from dataclasses import dataclass
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor
 import time
+from pathlib import Path
 import logging
-from typing import List, Any
+from typing import List, Any, Optional
+import numpy as np
 from langchain_core.documents import Document
 from sparql_llm.loaders.sparql_examples_loader import SparqlExamplesLoader
 from sparql_llm.loaders.sparql_void_shapes_loader import SparqlVoidShapesLoader
-from sparql_llm.utils import get_prefixes_and_schema_for_endpoints
 from qdrant_client.http.models import Distance, VectorParams, PointStruct
-from qdrant_client.models import FieldCondition, Filter, MatchValue
-
-from config.config import settings, qdrant_client, endpoints
+from qdrant_client.models import (
+    BinaryQuantization,
+    BinaryQuantizationConfig,
+    QuantizationSearchParams,
+    QueryRequest,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    SearchParams,
+)
+
+from config.config import settings, get_qdrant_client, get_prefixes_and_schema, endpoints
 from src.embeddings import EmbeddingModel
 
 from helpers import logger
 
+def _load_endpoint_docs(endpoint: dict, prefix_map: dict) -> List[Document]:
+    """Load the example queries and VoID shapes documents of a single SPARQL endpoint."""
+    logger.info(f"Loading documents from endpoint {endpoint.get('endpoint_url')}...")
+    docs: List[Document] = []
+    if endpoint.get("examples_file"):
+        docs += SparqlExamplesLoader(
+            endpoint.get("endpoint_url"),
+            examples_file=endpoint.get("examples_file"),
+        ).load()
+
+    if endpoint.get("void_file"):
+        docs += SparqlVoidShapesLoader(
+            endpoint.get("endpoint_url"),
+            prefix_map=prefix_map,
+            void_file=endpoint.get("void_file"),
+            examples_file=endpoint.get("examples_file"),
+        ).load()
+    return docs
+
+def load_endpoints_docs() -> List[Document]:
+    """Load the documents of all configured endpoints, fetching the endpoints in parallel."""
+    if not endpoints:
+        return []
+    prefix_map, _void_schema = get_prefixes_and_schema()
+    with ThreadPoolExecutor(max_workers=min(8, len(endpoints))) as executor:
+        results = executor.map(lambda endpoint: _load_endpoint_docs(endpoint, prefix_map), endpoints)
+        return [doc for docs in results for doc in docs]
+
+@dataclass(slots=True)
+class MockScoredPoint:
+    """Mimics qdrant's ScoredPoint for the in-memory knowledge bases."""
+    payload: dict
+    score: float = 0.0
+
 class KnowledgeBase(ABC):
     @abstractmethod
     def initialize(self) -> None:
@@ -27,6 +74,20 @@ class KnowledgeBase(ABC):
         pass
 
 
+def _qdrant_quantization_config():
+    if settings.qdrant_quantization == "scalar":
+        return ScalarQuantization(scalar=ScalarQuantizationConfig(type=ScalarType.INT8, quantile=0.99, always_ram=True))
+    if settings.qdrant_quantization == "binary":
+        return BinaryQuantization(binary=BinaryQuantizationConfig(always_ram=True))
+    return None
+
+QDRANT_UPSERT_BATCH_SIZE = 256
+
+# Search the quantized vectors first, then rescore the oversampled candidates with the original vectors
+QDRANT_SEARCH_PARAMS = SearchParams(
+    quantization=QuantizationSearchParams(ignore=False, rescore=True, oversampling=2.0)
+)
+
 class QdrantKnowledgeBase(KnowledgeBase):
     def __init__(self):
         self.embedding_model = EmbeddingModel(
@@ -34,7 +95,7 @@ class QdrantKnowledgeBase(KnowledgeBase):
             provider=settings.embedding_provider,
             base_url=settings.ollama_host
         )
-        self.client = qdrant_client
+        self.client = get_qdrant_client()
 
     def initialize(self) -> None:
         """Initialize the vectordb with example queries and ontology descriptions from the SPARQL endpoints"""
@@ -60,26 +121,9 @@ class QdrantKnowledgeBase(KnowledgeBase):
 
         logger.info("Initializing Qdrant knowledge base...")
 
-        docs: List[Document] = []
-        prefix_map, _void_schema = get_prefixes_and_schema_for_endpoints(endpoints)
-
         # Gets documents from the SPARQL endpoints
-        for endpoint in endpoints:
-            if endpoint.get("examples_file"):
-                 docs += SparqlExamplesLoader(
-                    endpoint.get("endpoint_url"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
-
-            if endpoint.get("void_file"):
-                docs += SparqlVoidShapesLoader(
-                    endpoint.get("endpoint_url"),
-                    prefix_map=prefix_map,
-                    void_file=endpoint.get("void_file"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
-
-            logger.info(f"Generating embeddings for {len(docs)} documents from endpoint {endpoint.get('endpoint_url')}...")
+        docs = load_endpoints_docs()
+        logger.info(f"Generating embeddings for {len(docs)} documents...")
         start_time = time.time()
         
         # Re-create collection
@@ -89,166 +133,109 @@ class QdrantKnowledgeBase(KnowledgeBase):
         self.client.create_collection(
             collection_name=settings.docs_collection_name,
             vectors_config=VectorParams(size=settings.embedding_dimensions, distance=Distance.COSINE),
+            quantization_config=_qdrant_quantization_config(),
         )
         
         if not docs:
             logger.info("No documents found to index.")
             return
 
-        texts = [d.page_content for d in docs]
-        metadatas = [d.metadata for d in docs]
-        
-        # Embed
-        embeddings = list(self.embedding_model.embed(texts))
-        
-        points = [
-            PointStruct(
-                id=i, 
-                vector=embedding, 
-                payload={"page_content": text, "metadata": meta}
-            )
-            for i, (text, meta, embedding) in enumerate(zip(texts, metadatas, embeddings))
-        ]
-        
-        # Batch upsert
-        if points:
+        # Embed and upsert in batches to bound memory and request size
+        for start in range(0, len(docs), QDRANT_UPSERT_BATCH_SIZE):
+            batch = docs[start:start + QDRANT_UPSERT_BATCH_SIZE]
+            embeddings = self.embedding_model.embed([d.page_content for d in batch])
             self.client.upsert(
                 collection_name=settings.docs_collection_name,
-                points=points
+                points=[
+                    PointStruct(
+                        id=start + i,
+                        vector=embedding.tolist(),
+                        payload={"page_content": doc.page_content, "metadata": doc.metadata}
+                    )
+                    for i, (doc, embedding) in enumerate(zip(batch, embeddings))
+                ],
+                # Only wait for the last batch, Qdrant applies the updates in order
+                wait=start + QDRANT_UPSERT_BATCH_SIZE >= len(docs),
             )
         
         logger.info(f"Done generating and indexing {len(docs)} documents into the vectordb in {time.time() - start_time} seconds")
 
     def search(self, question: str, potential_classes: List[str], steps: List[str]) -> List[Any]:
         relevant_docs = []
+        seen_answers = set()
         
         to_embed = [question] + steps + potential_classes
-        search_embeddings = list(self.embedding_model.embed(to_embed))
+        search_embeddings = list(self.embedding_model.embed_queries(to_embed))
         
-        for search_embedding in search_embeddings:
-            # Get SPARQL example queries
-            relevant_docs.extend(
-                doc
-                for doc in self.client.query_points(
-                    query=search_embedding,
-                    collection_name=settings.docs_collection_name,
-                    limit=settings.default_number_of_retrieved_docs,
-                    score_threshold=settings.similarity_threshold,
-                    query_filter=Filter(
-                        must=[
-                            FieldCondition(
-                                key="metadata.doc_type",
-                                match=MatchValue(value="SPARQL endpoints query examples"),
-                            )
-                        ]
-                    ),
-                ).points
-                if doc.payload
-                and doc.payload.get("metadata", {}).get("answer")
-                not in {
-                    existing_doc.payload.get("metadata", {}).get("answer") if existing_doc.payload else None
-                    for existing_doc in relevant_docs
-                }
-            )
-            # Get other relevant documentation (classes schemas, general information)
-            relevant_docs.extend(
-                doc
-                for doc in self.client.query_points(
-                    query=search_embedding,
-                    collection_name=settings.docs_collection_name,
-                    limit=settings.default_number_of_retrieved_docs,
+        k = settings.default_number_of_retrieved_docs
+        # One unfiltered search per embedding, split into examples and other docs client-side
+        responses = self.client.query_batch_points(
+            collection_name=settings.docs_collection_name,
+            requests=[
+                QueryRequest(
+                    query=search_embedding.tolist(),
+                    limit=2 * k,
                     score_threshold=settings.similarity_threshold,
-                    query_filter=Filter(
-                        must_not=[
-                            FieldCondition(
-                                key="metadata.doc_type",
-                                match=MatchValue(value="SPARQL endpoints query examples"),
-                            )
-                        ]
-                    ),
-                ).points
-                if doc.payload
-                and doc.payload.get("metadata", {}).get("answer")
-                not in {
-                    existing_doc.payload.get("metadata", {}).get("answer") if existing_doc.payload else None
-                    for existing_doc in relevant_docs
-                }
-            )
+                    params=QDRANT_SEARCH_PARAMS,
+                    with_payload=True,
+                )
+                for search_embedding in search_embeddings
+            ],
+        )
+
+        for response in responses:
+            examples, others = [], []
+            for doc in response.points:
+                if not doc.payload:
+                    continue
+                metadata = doc.payload.get("metadata", {})
+                bucket = examples if metadata.get("doc_type") == "SPARQL endpoints query examples" else others
+                if len(bucket) >= k:
+                    continue
+                ans = metadata.get("answer")
+                if ans in seen_answers:
+                    continue
+                if ans: seen_answers.add(ans)
+                bucket.append(doc)
+            # SPARQL example queries first, then other relevant documentation (classes schemas, general information)
+            relevant_docs.extend(examples)
+            relevant_docs.extend(others)
         return relevant_docs
 
 class LocalKnowledgeBase(KnowledgeBase):
     def __init__(self):
         self.documents: List[Document] = []
+        # Lower-cased content and metadata of each document, matched against the potential classes
+        self.searchable_texts: List[str] = []
 
     def initialize(self) -> None:
         logger.info("Initializing Simple Knowledge Base (Memory)...")
-        self.documents = []
-        prefix_map, _void_schema = get_prefixes_and_schema_for_endpoints(endpoints)
-
-        for endpoint in endpoints:
-            if endpoint.get("examples_file"):
-                self.documents += SparqlExamplesLoader(
-                    endpoint.get("endpoint_url"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
-
-            if endpoint.get("void_file"):
-                self.documents += SparqlVoidShapesLoader(
-                    endpoint.get("endpoint_url"),
-                    prefix_map=prefix_map,
-                    void_file=endpoint.get("void_file"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
+        self.documents = load_endpoints_docs()
+        # The NUL separator keeps a class from matching across content and metadata
+        self.searchable_texts = [
+            f"{doc.page_content.lower()}\x00{str(doc.metadata).lower()}" for doc in self.documents
+        ]
         logger.info(f"Loaded {len(self.documents)} documents into memory.")
 
     def search(self, question: str, potential_classes: List[str], steps: List[str]) -> List[Any]:
-        results = []
-        
-        # Combine search terms
-        search_terms = set([question] + steps + potential_classes)
-        search_terms = {t.lower() for t in search_terms if t}
+        # Simple scoring logic: return the documents whose content or metadata mention any potential class,
+        # or all of them when no classes are given.
+        # "returns them all or based on potential classes"
+
+        # One alternation regex scans each document once for all classes
+        classes_pattern = None
+        if potential_classes:
+            classes_pattern = re.compile("|".join(re.escape(pc.lower()) for pc in potential_classes))
+
+        return [
+            MockScoredPoint(payload={"page_content": doc.page_content, "metadata": doc.metadata})
+            for doc, text in zip(self.documents, self.searchable_texts)
+            if classes_pattern is None or classes_pattern.search(text)
+        ]
 
-        for doc in self.documents:
+# doc_matrix rows multiplied per step by the int8 search, bounds the int32 copy of the block
+INT8_SCORE_BLOCK_ROWS = 4096
 
-            
-            # Simple scoring logic: check if any potential class or step is in the content
-            # Or just return all if the user hinted at that.
-            # "returns them all or based on potential classes"
-            
-            # Use a mock class to mimic ScoredPoint
-            class MockScoredPoint:
-                def __init__(self, payload):
-                    self.payload = payload
-            
-            payload = {
-                "page_content": doc.page_content,
-                "metadata": doc.metadata
-            }
-            
-            # Filtering logic (Naive)
-            # If doc matches potential classes in its content or metadata
-            add_doc = False
-            if not potential_classes:
-                 add_doc = True 
-            
-            # Check if any potential class is in the content
-            content_lower = doc.page_content.lower()
-            metadata_str = str(doc.metadata).lower()
-            
-            if any(pc.lower() in content_lower for pc in potential_classes):
-                add_doc = True
-            elif any(pc.lower() in metadata_str for pc in potential_classes):
-                add_doc = True
-            
-            
-            if not potential_classes and not steps:
-                add_doc = True
-            
-            if add_doc:
-                results.append(MockScoredPoint(payload=payload))
-
-        # If too many, maybe limit?
-        return results
 
 class LocalEmbeddingKnowledgeBase(KnowledgeBase):
     def __init__(self):
@@ -257,28 +244,20 @@ class LocalEmbeddingKnowledgeBase(KnowledgeBase):
             provider=settings.embedding_provider,
             base_url=settings.ollama_host,
         )
-        self.documents = []
+        self.docs: List[Document] = []
+        # (N, dim) document embeddings: L2-normalized float32, or raw int8 when quantized
+        self.doc_matrix = np.empty((0, settings.embedding_dimensions), dtype=np.float32)
+        # Per-dimension scale of the int8 embeddings, None when stored as float32
+        self.scale = None
+        # Per-row inverse norms of the dequantized int8 embeddings, None when stored as float32
+        self.inv_norms = None
+        # Row indices of the example queries and of the other documents in doc_matrix
+        self.example_rows = np.empty(0, dtype=np.intp)
+        self.other_rows = np.empty(0, dtype=np.intp)
 
     def initialize(self) -> None:
         logger.info("Initializing In-Memory Embedding Knowledge Base...")
-        docs: List[Document] = []
-        prefix_map, _void_schema = get_prefixes_and_schema_for_endpoints(endpoints)
-
-        for endpoint in endpoints:
-            logger.info(f"Loading documents from endpoint {endpoint.get('endpoint_url')}...")
-            if endpoint.get("examples_file"):
-                docs += SparqlExamplesLoader(
-                    endpoint.get("endpoint_url"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
-
-            if endpoint.get("void_file"):
-                docs += SparqlVoidShapesLoader(
-                    endpoint.get("endpoint_url"),
-                    prefix_map=prefix_map,
-                    void_file=endpoint.get("void_file"),
-                    examples_file=endpoint.get("examples_file"),
-                ).load()
+        docs = load_endpoints_docs()
         logger.info(f"Loaded {len(docs)} documents into memory.")
         if not docs:
             logger.info("No documents found to index.")
@@ -288,12 +267,63 @@ class LocalEmbeddingKnowledgeBase(KnowledgeBase):
         start_time = time.time()
         
         texts = [d.page_content for d in docs]
-        embeddings = list(self.embedding_model.embed(texts))
-        
-        self.documents = list(zip(docs, embeddings))
+        cache_path = self._embeddings_cache_path(texts)
+        if cache_path is not None and cache_path.exists():
+            # Memory-map the cached matrix instead of re-embedding every document
+            self.doc_matrix = np.load(cache_path, mmap_mode="r")
+            self.scale = np.load(cache_path.with_suffix(".scale.npy")) if settings.quantize_embeddings else None
+            logger.info(f"Loaded cached embeddings from {cache_path}")
+        elif settings.quantize_embeddings:
+            self.doc_matrix, self.scale = self.embedding_model.embed_int8(texts)
+        else:
+            # Normalize in place, the matrix is the only copy of the embeddings
+            self.doc_matrix = self.embedding_model.embed(texts)
+            norms = np.linalg.norm(self.doc_matrix, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            self.doc_matrix /= norms
+            self.scale = None
+        if cache_path is not None and not cache_path.exists():
+            self._save_embeddings_cache(cache_path)
+
+        if self.scale is not None:
+            norms = np.linalg.norm(self.doc_matrix * self.scale, axis=1)
+            self.inv_norms = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+        else:
+            self.inv_norms = None
+        self.docs = docs
+        is_example = np.array([d.metadata.get("doc_type") == "SPARQL endpoints query examples" for d in docs])
+        self.example_rows = np.flatnonzero(is_example)
+        self.other_rows = np.flatnonzero(~is_example)
         
         logger.info(f"Done generating embeddings for {len(docs)} documents in {time.time() - start_time} seconds")
 
+    def _embeddings_cache_path(self, texts: List[str]) -> Optional[Path]:
+        """Path of the cached doc_matrix, stamped with a hash of the model settings and the document texts."""
+        if not settings.cache_dir:
+            return None
+        digest = hashlib.sha256(
+            f"{settings.embedding_provider}|{settings.embedding_model}|{settings.quantize_embeddings}".encode()
+        )
+        for text in texts:
+            digest.update(text.encode())
+            digest.update(b"\x00")
+        return Path(settings.cache_dir) / f"kb_{digest.hexdigest()[:16]}.npy"
+
+    def _save_embeddings_cache(self, cache_path: Path) -> None:
+        try:
+            cache_path.parent.mkdir(parents=True, exist_ok=True)
+            # The matrix is written last, its presence marks a complete cache entry
+            if self.scale is not None:
+                np.save(cache_path.with_suffix(".scale.npy"), self.scale)
+            np.save(cache_path, self.doc_matrix)
+            # Drop the caches of previous document sets or models
+            prefix = cache_path.name.split(".")[0]
+            for stale in cache_path.parent.glob("kb_*.npy"):
+                if not stale.name.startswith(prefix):
+                    stale.unlink()
+        except OSError as e:
+            logger.warning(f"Could not write the embeddings cache {cache_path}: {e}")
+
     def search(self, question: str, potential_classes: List[str], steps: List[str]) -> List[Any]:
         results = []
         to_embed = [question] + steps + potential_classes
@@ -302,59 +332,67 @@ class LocalEmbeddingKnowledgeBase(KnowledgeBase):
         if not to_embed:
             return []
 
-        search_embeddings = list(self.embedding_model.embed(to_embed))
+        search_embeddings = np.asarray(self.embedding_model.embed_queries(to_embed), dtype=np.float32)
         seen_answers = set()
-        
-        def cosine_similarity(v1, v2):
-            dot = sum(a*b for a,b in zip(v1, v2))
-            mag1 = math.sqrt(sum(a*a for a in v1))
-            mag2 = math.sqrt(sum(b*b for b in v2))
-            if mag1 == 0 or mag2 == 0: return 0.0
-            return dot / (mag1 * mag2)
-
-        class MockScoredPoint:
-            def __init__(self, payload, score):
-                self.payload = payload
-                self.score = score
-
-        for search_emb in search_embeddings:
-            scores = []
-            for doc, doc_emb in self.documents:
-                score = cosine_similarity(search_emb, doc_emb)
-                scores.append((score, doc))
-            
-            scores.sort(key=lambda x: x[0], reverse=True)
-            
-            # 1. Example queries
-            added = 0
-            for score, doc in scores:
-                if added >= settings.default_number_of_retrieved_docs: break
-                if doc.metadata.get("doc_type") == "SPARQL endpoints query examples":
-                    ans = doc.metadata.get("answer")
-                    if ans not in seen_answers:
-                        if ans: seen_answers.add(ans)
-                        results.append(MockScoredPoint(
-                            payload={"page_content": doc.page_content, "metadata": doc.metadata}, 
-                            score=score
-                        ))
-                        added += 1
-
-            # 2. Others
-            added = 0
-            for score, doc in scores:
-                if added >= settings.default_number_of_retrieved_docs: break
-                if doc.metadata.get("doc_type") != "SPARQL endpoints query examples":
-                    ans = doc.metadata.get("answer")
-                    if ans not in seen_answers:
-                        if ans: seen_answers.add(ans)
-                        results.append(MockScoredPoint(
-                            payload={"page_content": doc.page_content, "metadata": doc.metadata}, 
-                            score=score
-                        ))
-                        added += 1
-                        
+
+        # Cosine similarity of every query against every document in one matrix product
+        norms = np.linalg.norm(search_embeddings, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        queries = search_embeddings / norms
+        if self.scale is not None:
+            all_scores = self._int8_scores(queries)
+        else:
+            all_scores = queries @ self.doc_matrix.T
+
+        k = settings.default_number_of_retrieved_docs
+        for scores in all_scores:
+            # 1. Example queries, 2. Others
+            for rows in (self.example_rows, self.other_rows):
+                added = 0
+                examined = set()
+                # Rows with an answer seen before are skipped, so over-fetch and rank every row if that wasn't enough
+                for fetch in (2 * k + len(seen_answers), len(rows)):
+                    for i in self._top_rows(scores, rows, fetch):
+                        if added >= k: break
+                        if i in examined: continue
+                        examined.add(i)
+                        doc = self.docs[i]
+                        ans = doc.metadata.get("answer")
+                        if ans not in seen_answers:
+                            if ans: seen_answers.add(ans)
+                            results.append(MockScoredPoint(
+                                payload={"page_content": doc.page_content, "metadata": doc.metadata}, 
+                                score=float(scores[i])
+                            ))
+                            added += 1
+                    if added >= k or fetch >= len(rows): break
+
         return results
 
+    def _int8_scores(self, queries: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of the normalized queries against the int8 doc_matrix, computed with int32 dot products.
+
+        The queries are folded with the per-dimension scale and quantized to int8 themselves, so doc_matrix is never
+        upcast to float. It is multiplied in row blocks, only one block is cast to int32 at a time.
+        """
+        weighted = queries * self.scale
+        q_scale = np.max(np.abs(weighted), axis=1, keepdims=True) / 127.0
+        q_scale[q_scale == 0] = 1.0
+        q_int8 = np.round(weighted / q_scale).astype(np.int8).T
+        dots = np.empty((len(self.doc_matrix), len(queries)), dtype=np.int32)
+        for start in range(0, len(self.doc_matrix), INT8_SCORE_BLOCK_ROWS):
+            block = self.doc_matrix[start:start + INT8_SCORE_BLOCK_ROWS]
+            np.matmul(block, q_int8, out=dots[start:start + len(block)], dtype=np.int32)
+        return (dots.T * q_scale).astype(np.float32) * self.inv_norms
+
+    @staticmethod
+    def _top_rows(scores: np.ndarray, rows: np.ndarray, k: int) -> np.ndarray:
+        """Return the k rows with the highest scores, best first."""
+        if k < len(rows):
+            rows = rows[np.argpartition(-scores[rows], k)[:k]]
+        return rows[np.argsort(-scores[rows])]
+
 # Factory to get the KB
 def get_knowledge_base() -> KnowledgeBase:
     if settings.vector_store_type == "memory":
@@ -1,33 +1,33 @@
 import argparse
-import json
+import orjson
 import logging
 import asyncio
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 # Aggressively suppress warnings
 warnings.simplefilter("ignore")
 
 from fastmcp import FastMCP, settings as mcp_settings
 
-from config.config import settings, endpoints
+from config.config import settings, get_prefixes_and_schema
 from src.knowledge_base import get_knowledge_base
-from src.utils.utils import format_docs, _format_doc
+from src.utils.utils import format_docs
 
-from sparql_llm.utils import get_prefixes_and_schema_for_endpoints
 from sparql_llm.validate_sparql import validate_sparql
 
 from typing_extensions import Required
 from typing import Optional
 
 from src.tools.sparql_search import SparqlClient
-from src.tools.nominatim_search import NominatimGeocoder
+from src.tools.nominatim_search import GEOCODER
 from src.tools.web_search import DuckDuckGoSearch
 
 # Setup Logger
 from helpers import logger
 
 # Prefixes and schema for validation
-prefixes_map, endpoints_void_dict = get_prefixes_and_schema_for_endpoints(endpoints)
+prefixes_map, endpoints_void_dict = get_prefixes_and_schema()
 
 mcp = FastMCP(
     name="Decide MCP Server",
@@ -41,6 +41,21 @@ try:
 except Exception as e:
     logger.error(f"Error checking or initializing knowledge base: {e}")
 
+# Bounded pool for the blocking knowledge base searches, bursts queue instead of spawning threads
+_SEARCH_POOL = ThreadPoolExecutor(max_workers=settings.search_workers, thread_name_prefix="kb-search")
+
+# HTTP clients are reused across tool calls to keep their connections alive
+_WEB_SEARCH = DuckDuckGoSearch(cache_size=settings.tool_cache_size, cache_ttl=settings.tool_cache_ttl)
+_SPARQL_CLIENTS: dict[str, SparqlClient] = {}
+
+async def aclose_http_clients() -> None:
+    """Close the shared tool HTTP clients, called on app shutdown."""
+    await GEOCODER.aclose()
+    await _WEB_SEARCH.aclose()
+    for client in _SPARQL_CLIENTS.values():
+        await client.aclose()
+    _SPARQL_CLIENTS.clear()
+
 # --- Legacy Tools ---
 
 @mcp.tool()
@@ -56,9 +71,8 @@ async def search_location(query: str, city: Optional[str] = "Gent", country: Opt
     Returns:
         str: JSON string of the geocoding result containing OpenStreetMap URI, address, latitude, and longitude.
     """
-    geocoder = NominatimGeocoder(base_url=settings.nominatim_endpoint)
-    result = await geocoder.search(query=query, city=city, country=country)
-    return json.dumps(result) if result else "No results found"
+    result = await GEOCODER.search(query=query, city=city, country=country)
+    return orjson.dumps(result).decode() if result else "No results found"
 
 @mcp.tool()
 async def search_web(query: str, max_results: int = 5) -> str:
@@ -69,11 +83,9 @@ async def search_web(query: str, max_results: int = 5) -> str:
     Returns:
         str: JSON string of the search results.
     """
-    
-    ddg_search = DuckDuckGoSearch()
-    results = await ddg_search.search(query=query, max_results=max_results)
+    results = await _WEB_SEARCH.search(query=query, max_results=max_results)
     if results:
-        return json.dumps(results)
+        return orjson.dumps(results).decode()
     return "No results found."
 
 
@@ -92,6 +104,8 @@ The following {docs_count} documents contain relevant query examples, and classe
 
 {formatted_docs}
 """
+# Split once so each call only joins the formatted docs in between
+_PROMPT_TOOL_SPARQL_PRE, _PROMPT_TOOL_SPARQL_POST = PROMPT_TOOL_SPARQL.split("{formatted_docs}")
 
 @mcp.tool()
 async def search_sparql_docs(question: str, potential_classes: list[str], steps: list[str]) -> str:
@@ -108,11 +122,16 @@ async def search_sparql_docs(question: str, potential_classes: list[str], steps:
     def _sync_search():
         relevant_docs = knowledge_base.search(question, potential_classes, steps)   
         
-        logger.info(f"Formatted response for SPARQL query construction: \n{PROMPT_TOOL_SPARQL.format(docs_count=str(len(relevant_docs)), formatted_docs=format_docs(relevant_docs))}\n")
+        response = "".join((
+            _PROMPT_TOOL_SPARQL_PRE.replace("{docs_count}", str(len(relevant_docs))),
+            format_docs(relevant_docs),
+            _PROMPT_TOOL_SPARQL_POST,
+        ))
+        logger.info(f"Formatted response for SPARQL query construction: \n{response}\n")
           
-        return PROMPT_TOOL_SPARQL.format(docs_count=str(len(relevant_docs)), formatted_docs=format_docs(relevant_docs))
+        return response
 
-    return await asyncio.to_thread(_sync_search)
+    return await asyncio.get_running_loop().run_in_executor(_SEARCH_POOL, _sync_search)
 
 
 FIX_QUERY_PROMPT = """Please fix the query, and try again.
@@ -150,7 +169,9 @@ async def execute_sparql_query(sparql_query: str, endpoint_url: str) -> str:
         return resp_msg
     # Execute the SPARQL query
     try:
-        client = SparqlClient(endpoint=endpoint_url)
+        client = _SPARQL_CLIENTS.get(endpoint_url)
+        if client is None:
+            client = _SPARQL_CLIENTS[endpoint_url] = SparqlClient(endpoint=endpoint_url)
         # SparqlClient.search returns List[Dict] (the bindings) or raises exception
         bindings = await client.search(query=sparql_query, max_results=50) 
         
@@ -166,7 +187,7 @@ async def execute_sparql_query(sparql_query: str, endpoint_url: str) -> str:
             
             # Construct a response object 
             res = {"results": {"bindings": bindings}}
-            resp_msg += f":\n```\n{json.dumps(res, indent=2)}\n```"
+            resp_msg += f":\n```\n{orjson.dumps(res, option=orjson.OPT_INDENT_2).decode()}\n```"
     except Exception as e:
         resp_msg += f"SPARQL query returned error: {e}. {FIX_QUERY_PROMPT}\n```sparql\n{sparql_query}\n```"
     return resp_msg
@@ -10,13 +10,146 @@ from typing import Optional, Type, TypedDict
 
 from src.agent import SparqlResponse
 from config.config import TaskOperations, settings, TaskStatus, endpoints
-from escape_helpers import sparql_escape_uri, sparql_escape_string
-from helpers import query, update, logger
+from src.utils.escape import _escape_uri_fast
+from helpers import logger
+from src.utils.triplestore import aquery, aupdate
 from src.utils.utils import get_prefixes_for_query, initialize_agent
 
 # For location enrichment
 from src.utils.nominatim_parser import NominatimParser
-from src.tools.nominatim_search import NominatimGeocoder
+from src.tools.nominatim_search import GEOCODER
+
+# Prefix bundles, built once and shared by the templates below
+_STATUS_PREFIXES = ("task", "adms")
+_PREFIX_TASK_ADMS = get_prefixes_for_query(*_STATUS_PREFIXES)
+_PREFIX_TASK_DCT_NFO_NIE = get_prefixes_for_query("task", "dct", "nfo", "nie")
+_PREFIX_SKOS = get_prefixes_for_query("skos")
+_PREFIX_TASK_OA_RDF_RDFS_DCT = get_prefixes_for_query("task", "oa", "rdf", "rdfs", "dct")
+# Prefixes of the queued update statements, resolved when flushed
+_NEL_ANNOTATION_PREFIXES = ("eli", "mu", "skos", "oa", "prov", "rdf", "xsd", "task", "nfo")
+
+_NEL_AGENT_URI = _escape_uri_fast(settings.nel_agent_uri)
+
+# Query templates, built once. Update statements carry no prefixes, those are added when they are sent.
+_FROM_URI_TMPL = Template(
+    _PREFIX_TASK_ADMS +
+    """
+    SELECT ?task ?taskType WHERE {
+      BIND($uri AS ?task)
+      ?task task:operation ?taskType .
+    }
+""")
+
+# DELETE DATA of a missing triple is a no-op, so no WHERE/OPTIONAL join is needed to swap the status
+_STATUS_TMPL = Template(f"""
+    DELETE DATA {{
+    GRAPH <{settings.default_graph}> {{
+        $task adms:status $old_status .
+    }}
+    }} ;
+    INSERT DATA {{
+    GRAPH <{settings.default_graph}> {{
+        $task adms:status $new_status .
+    }}
+    }}
+""")
+
+_GOVERNING_UNIT_URI_TMPL = Template(
+    _PREFIX_TASK_DCT_NFO_NIE +
+    f"""
+    SELECT ?resource WHERE {{
+        GRAPH <{settings.default_graph}> {{
+            $task dct:isPartOf ?job .
+            ?firstTask dct:isPartOf ?job ;
+                    task:index "0" ;
+                    task:inputContainer ?container .
+            ?container task:hasResource ?resource .
+        }}
+    }}
+""")
+
+_GOVERNING_UNIT_NAME_TMPL = Template(
+    _PREFIX_SKOS +
+    """
+    SELECT ?name WHERE {
+        $governing_unit skos:prefLabel ?name .
+    } LIMIT 1
+""")
+
+# Variables selected by _FETCH_INPUT_TMPL, ?location is optional
+_INPUT_VARIABLES = ("annotation", "entity", "entityClass", "entityLabel", "location")
+
+_FETCH_INPUT_TMPL = Template(
+    _PREFIX_TASK_OA_RDF_RDFS_DCT +
+    f"""
+    SELECT ?annotation ?entity ?entityClass ?entityLabel ?location WHERE {{
+        GRAPH <{settings.default_graph}> {{
+            $task task:inputContainer ?container .
+            ?container task:hasResource ?annotation .
+        }}
+
+        GRAPH <{settings.publication_graph}> {{
+            ?annotation oa:hasBody ?statement .
+            ?statement rdf:object ?entity .
+
+            ?entity a ?entityClass ;
+                    rdfs:label ?entityLabel .
+
+            OPTIONAL {{
+                ?entity dct:spatial ?location . 
+            }}
+        }}
+    }}
+""")
+
+_NEL_ANNOTATION_TMPL = Template(f"""
+    INSERT {{
+    GRAPH <{settings.publication_graph}> {{
+        $new_annotation a oa:Annotation ;
+            mu:uuid $new_annotation_uuid ;
+            oa:hasBody $new_statement ;
+            oa:motivatedBy oa:linking ;
+            oa:hasTarget ?target .
+
+        $new_statement a rdf:Statement ;
+            mu:uuid $new_statement_uuid ;
+            rdf:subject $entity_uri ;
+            rdf:predicate skos:exactMatch ;
+            rdf:object $found_uri .
+
+        $extra_triples
+
+        $activity a prov:Activity ;
+            mu:uuid $activity_uuid ;
+            prov:generated $new_annotation ;
+            prov:wasAssociatedWith $agent_uri ;
+            prov:used ?target ;
+            prov:startedAtTime $start_time ;
+            prov:endedAtTime $end_time .
+    }}
+    }}
+    WHERE {{
+    GRAPH <{settings.publication_graph}> {{
+        $prev_annotation_uri oa:hasTarget ?target .
+    }}
+    }}
+""")
+
+# Written as INSERT DATA, so the container and its link don't depend on the target match of _NEL_ANNOTATION_TMPL
+_NEL_RESULTS_CONTAINER_TMPL = Template(f"""
+    INSERT DATA {{
+    GRAPH <{settings.default_graph}> {{
+        $container a nfo:DataContainer ;
+            mu:uuid "$container_uuid" ;
+            task:hasResource $new_annotation .
+
+        $task task:resultsContainer $container .
+    }}
+    }}
+""")
+
+# Task subclasses by their __task_type__, filled by Task.__init_subclass__
+_TASK_REGISTRY: dict[str, Type['Task']] = {}
 
 class Task(ABC):
     """Base class for background tasks that process data from the triplestore."""
@@ -24,43 +157,41 @@ class Task(ABC):
     def __init__(self, task_uri: str):
         super().__init__()
         self.task_uri = task_uri
-        self.results_container_uris = []
+        # The task URI appears in most queries of this task, escape it once
+        self._task_uri_escaped = _escape_uri_fast(task_uri)
         self.logger = logger
         self.agent_instance = initialize_agent()
-        self.retries = 0
+        # SPARQL update statements buffered by queue_update(), written by flush_updates() once the task succeeded
+        self._pending_updates: list[str] = []
+        self._pending_prefixes: set[str] = set()
+        # Inputs that couldn't be processed, the results of the others are still written and the task ends FAILED
+        self.failed_inputs: list[tuple[dict, Exception]] = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Register concrete task types once at class creation, lookup() is then a dict get
+        if "__task_type__" in cls.__dict__:
+            _TASK_REGISTRY[cls.__task_type__] = cls
 
     @classmethod
     def supported_operations(cls) -> list[Type['Task']]:
-        all_ops = []
-        for subclass in cls.__subclasses__():
-            if hasattr(subclass, '__task_type__'):
-                all_ops.append(subclass)
-            else:
-                all_ops.extend(subclass.supported_operations())
-        return all_ops
+        return [subclass for subclass in _TASK_REGISTRY.values() if issubclass(subclass, cls)]
 
     @classmethod
-    def lookup(cls, task_type: str) -> Optional['Task']:
+    def lookup(cls, task_type: str) -> Optional[Type['Task']]:
         """
-        Yield all subclasses of the given class, per:
+        Return the registered Task subclass handling the given task type, if any.
         """
-        for subclass in cls.supported_operations():
-            if hasattr(subclass, '__task_type__') and subclass.__task_type__ == task_type:
-                return subclass
+        subclass = _TASK_REGISTRY.get(task_type)
+        if subclass is not None and issubclass(subclass, cls):
+            return subclass
         return None
 
     @classmethod
-    def from_uri(cls, task_uri: str) -> 'Task':
+    async def from_uri(cls, task_uri: str) -> 'Task':
         """Create a Task instance from its URI in the triplestore."""
-        q = Template(
-            get_prefixes_for_query("adms", "task") +
-            """
-            SELECT ?task ?taskType WHERE {
-              BIND($uri AS ?task)
-              ?task task:operation ?taskType .
-            }
-        """).substitute(uri=sparql_escape_uri(task_uri))
-        for b in query(q, sudo=True).get('results').get('bindings'):
+        q = _FROM_URI_TMPL.substitute(uri=_escape_uri_fast(task_uri))
+        for b in (await aquery(q, sudo=True)).get('results').get('bindings'):
             candidate_cls = cls.lookup(b['taskType']['value'])
             if candidate_cls is not None:
                 return candidate_cls(task_uri)
@@ -68,83 +199,59 @@ class Task(ABC):
                 "Unknown task type {0}".format(b['taskType']['value']))
         raise RuntimeError("Task with uri {0} not found".format(task_uri))
 
-    def change_state(self, old_state: str, new_state: str, results_container_uris: list = []) -> None:
-        """Update the task status in the triplestore."""
-
-        # Update the task status
-        status_query = Template(
-            get_prefixes_for_query("task", "adms") +
-            """
-            DELETE {
-            GRAPH <""" + settings.default_graph + """> {
-                ?task adms:status $old_status .
-            }
-            }
-            INSERT {
-            GRAPH <""" + settings.default_graph + """> {
-                ?task adms:status $new_status .
-            }
-            }
-            WHERE {
-            GRAPH <""" + settings.default_graph + """> {
-                BIND($task AS ?task)
-                OPTIONAL { ?task adms:status $old_status . }
-            }
-            }
-            """
-        )
-        query_string = status_query.substitute(
-            new_status=sparql_escape_uri(new_state),
-            old_status=sparql_escape_uri(old_state),
-            task=sparql_escape_uri(self.task_uri)
+    async def change_state(self, old_state: str, new_state: str) -> None:
+        """Update the task status."""
+        await aupdate(_PREFIX_TASK_ADMS + self._state_statement(old_state, new_state), sudo=True)
+
+    def _state_statement(self, old_state: str, new_state: str) -> str:
+        """Update statement (without PREFIX declarations) of a status change, see change_state()."""
+        return _STATUS_TMPL.substitute(
+            task=self._task_uri_escaped,
+            old_status=_escape_uri_fast(old_state),
+            new_status=_escape_uri_fast(new_state),
         )
 
-        update(query_string, sudo=True)
-
-        # Batch-insert results containers (if any)
-        if results_container_uris:
-            BATCH_SIZE = 50
-            insert_template = Template(
-                get_prefixes_for_query("task", "adms") +
-                """
-                INSERT {
-                GRAPH <""" + settings.default_graph + """> {
-                    ?task $results_container_line .
-                }
-                }
-                WHERE {
-                    BIND($task AS ?task)
-                }
-                """
-            )
+    def queue_update(self, prefix_names: tuple[str, ...], statement: str) -> None:
+        """
+        Buffer a SPARQL update statement (without PREFIX declarations).
 
-            for i in range(0, len(results_container_uris), BATCH_SIZE):
-                batch_uris = results_container_uris[i:i + BATCH_SIZE]
-                results_container_line = " ;\n".join(
-                    [f"task:resultsContainer {sparql_escape_uri(uri)}" for uri in batch_uris]
-                )
-                query_string = insert_template.substitute(
-                    task=sparql_escape_uri(self.task_uri),
-                    results_container_line=results_container_line
-                )
-                update(query_string, sudo=True)
+        Nothing is written until flush_updates(), which run() only calls once process() returned,
+        so a task that crashes leaves none of its results behind.
+        """
+        self._pending_prefixes.update(prefix_names)
+        self._pending_updates.append(statement)
+
+    async def flush_updates(self) -> None:
+        """Send all buffered update statements as a single update request, so they are written all or nothing."""
+        if not self._pending_updates:
+            return
+        q = get_prefixes_for_query(*self._pending_prefixes) + " ;\n".join(self._pending_updates)
+        self._pending_updates, self._pending_prefixes = [], set()
+        await aupdate(q, sudo=True)
 
     @contextlib.asynccontextmanager
     async def run(self):
         """Async Context manager for task execution with state transitions."""
         try:
-            self.change_state(TaskStatus.SCHEDULED.value,
+            await self.change_state(TaskStatus.SCHEDULED.value,
                               TaskStatus.BUSY.value)
             yield
-            self.change_state(
-                TaskStatus.BUSY.value,
-                TaskStatus.SUCCESS.value,
-                self.results_container_uris,
+            # Results of the inputs that succeeded are kept even if others failed, the task then ends FAILED
+            final_state = TaskStatus.FAILED.value if self.failed_inputs else TaskStatus.SUCCESS.value
+            if self.failed_inputs:
+                logger.error(f"{len(self.failed_inputs)} inputs of task {self.task_uri} failed, writing the results of the others")
+            # The final status is written with the buffered results, in the same request
+            self.queue_update(
+                _STATUS_PREFIXES,
+                self._state_statement(TaskStatus.BUSY.value, final_state),
             )
+            await self.flush_updates()
         except Exception as e:
             logger.error(f"Error executing task {self.task_uri}: {e}")
+            # Nothing of a crashed task is written
+            self._pending_updates, self._pending_prefixes = [], set()
             try:
-                self.change_state(TaskStatus.BUSY.value, TaskStatus.FAILED.value)
+                await self.change_state(TaskStatus.BUSY.value, TaskStatus.FAILED.value)
             except Exception as state_err:
                 logger.error(f"Failed to update task {self.task_uri} state to FAILED: {state_err}")
             raise
@@ -176,7 +283,7 @@ class NamedEntityLinkingTask(Task, ABC):
     def __init__(self, task_uri: str):
         super().__init__(task_uri)
 
-    def fetch_governing_unit_uri(self) -> str:
+    async def fetch_governing_unit_uri(self) -> str:
         """
         Retrieve the governing unit URI provided in the input container
         of the first task in the same job as this task.
@@ -187,27 +294,17 @@ class NamedEntityLinkingTask(Task, ABC):
         """
         governing_unit_uri = "Unknown URI"
 
-        q = f"""
-            {get_prefixes_for_query("task", "dct", "nfo", "nie")}
-            SELECT ?resource WHERE {{
-                GRAPH <{settings.default_graph}> {{
-                    <{self.task_uri}> dct:isPartOf ?job .
-                    ?firstTask dct:isPartOf ?job ;
-                            task:index "0" ;
-                            task:inputContainer ?container .
-                    ?container task:hasResource ?resource .
-                }}
-            }}
-        """
+        q = _GOVERNING_UNIT_URI_TMPL.substitute(task=self._task_uri_escaped)
 
-        bindings = query(q, sudo=True).get("results", {}).get("bindings", [])
+        # Asked again for every input without a location, the job's input doesn't change meanwhile
+        bindings = (await aquery(q, sudo=True, cache=True)).get("results", {}).get("bindings", [])
         if bindings:
             governing_unit_uri = bindings[0]["resource"]["value"]
 
         return governing_unit_uri
     
 
-    def fetch_governing_unit_name(self, governing_unit_uri: str) -> str:
+    async def fetch_governing_unit_name(self, governing_unit_uri: str) -> str:
         """
         Retrieve the name of the governing unit based on its URI.
 
@@ -220,14 +317,9 @@ class NamedEntityLinkingTask(Task, ABC):
         """
         governing_unit_name = "Unknown name"
 
-        q = f"""
-            {get_prefixes_for_query("skos")}
-            SELECT ?name WHERE {{
-                {sparql_escape_uri(governing_unit_uri)} skos:prefLabel ?name .
-            }} LIMIT 1
-        """
+        q = _GOVERNING_UNIT_NAME_TMPL.substitute(governing_unit=_escape_uri_fast(governing_unit_uri))
 
-        bindings = query(q, sudo=True).get("results", {}).get("bindings", [])
+        bindings = (await aquery(q, sudo=True, cache=True)).get("results", {}).get("bindings", [])
         if bindings:
             governing_unit_name = bindings[0]["name"]["value"]
 
@@ -235,55 +327,30 @@ class NamedEntityLinkingTask(Task, ABC):
     
     
 
-    def fetch_data_from_input_container(self) -> dict[str, str]:
+    async def fetch_data_from_input_container(self) -> Optional[list[dict[str, str]]]:
         """
         Retrieve the recognized named entity by bridging the harvesting graph 
         with the actual data graph.
         """
-        q = Template(
-            get_prefixes_for_query("task", "oa", "rdf", "rdfs", "dct") +
-            f"""
-            SELECT ?annotation ?entity ?entityClass ?entityLabel ?location WHERE {{
-                GRAPH <{settings.default_graph}> {{
-                    $task task:inputContainer ?container .
-                    ?container task:hasResource ?annotation .
-                }}
-
-                GRAPH <{settings.publication_graph}> {{
-                    ?annotation oa:hasBody ?statement .
-                    ?statement rdf:object ?entity .
-
-                    ?entity a ?entityClass ;
-                            rdfs:label ?entityLabel .
-
-                    OPTIONAL {{
-                        ?entity dct:spatial ?location . 
-                    }}
-                }}
-            }}
-            """
-        ).substitute(task=sparql_escape_uri(self.task_uri))
+        q = _FETCH_INPUT_TMPL.substitute(task=self._task_uri_escaped)
 
         logger.info(f"Fetching data for task {self.task_uri} with query: {q}")
 
-        bindings = query(q, sudo=True).get("results", {}).get("bindings", [])
+        bindings = (await aquery(q, sudo=True)).get("results", {}).get("bindings", [])
         if not bindings:
             return
 
-        results = [
-            {
-                "annotation": b.get("annotation", {}).get("value"),
-                "entityClass": b.get("entityClass", {}).get("value"),
-                "entityLabel": b.get("entityLabel", {}).get("value"),
-                "location": b.get("location", {}).get("value", "Unknown location"),
-                "entity": b.get("entity", {}).get("value"),
-            }
-            for b in bindings if not "person" in b.get("entityClass", {}).get("value", "").lower() # Excluding mandataries for now
-        ]
+        results = []
+        for b in bindings:
+            row = {k: b[k]["value"] for k in _INPUT_VARIABLES if k in b}
+            if "person" in row.get("entityClass", "").lower(): # Excluding mandataries for now
+                continue
+            row.setdefault("location", "Unknown location")
+            results.append(row)
 
         return results
 
-    def create_nel_annotation(self, prev_annotation_uri: str, entity_uri: str, found_uri: str, extra_triples: str = "", start_time: str = "", end_time: str = "") -> str:
+    async def create_nel_annotation(self, prev_annotation_uri: str, entity_uri: str, found_uri: str, extra_triples: str = "", start_time: str = "", end_time: str = "") -> str:
         """
         Create a new NEL (Named Entity Linking) annotation with:
         - A new rdf:Statement body (subject=entity, predicate=skos:exactMatch, object=found_uri)
@@ -291,6 +358,9 @@ class NamedEntityLinkingTask(Task, ABC):
         - oa:motivatedBy oa:linking
         - skos:exactMatch added to the entity
         - A prov:Activity with timestamps, prov:generated, prov:wasAssociatedWith, and prov:used
+        - An output data container holding the new annotation, linked to the task as task:resultsContainer
+
+        The annotation and its container are written by two queued update statements, sent in the same request.
 
         Args:
             prev_annotation_uri: URI of the original NER annotation
@@ -303,6 +373,7 @@ class NamedEntityLinkingTask(Task, ABC):
         Returns:
             The created NEL annotation URI.
         """
+        # UUIDs are hex and dashes only, they need no escaping
         new_annotation_uuid = str(uuid.uuid4())
         new_annotation_uri = f"http://data.lblod.info/id/annotations/{new_annotation_uuid}"
 
@@ -312,94 +383,35 @@ class NamedEntityLinkingTask(Task, ABC):
         activity_uuid = str(uuid.uuid4())
         activity_uri = f"http://data.lblod.info/id/activities/{activity_uuid}"
 
-        extra_triples_insert = "$extra_triples" if extra_triples else ""
-
-        q = Template(
-            get_prefixes_for_query("eli", "mu", "skos", "oa", "prov", "rdf", "xsd")
-            + f"""
-            INSERT {{
-            GRAPH <{settings.publication_graph}> {{
-                $new_annotation a oa:Annotation ;
-                    mu:uuid $new_annotation_uuid ;
-                    oa:hasBody $new_statement ;
-                    oa:motivatedBy oa:linking ;
-                    oa:hasTarget ?target .
-
-                $new_statement a rdf:Statement ;
-                    mu:uuid $new_statement_uuid ;
-                    rdf:subject $entity_uri ;
-                    rdf:predicate skos:exactMatch ;
-                    rdf:object $found_uri .
-
-                {extra_triples_insert}
-
-                $activity a prov:Activity ;
-                    mu:uuid $activity_uuid ;
-                    prov:generated $new_annotation ;
-                    prov:wasAssociatedWith $agent_uri ;
-                    prov:used ?target ;
-                    prov:startedAtTime $start_time ;
-                    prov:endedAtTime $end_time .
-            }}
-            }}
-            WHERE {{
-            GRAPH <{settings.publication_graph}> {{
-                $prev_annotation_uri oa:hasTarget ?target .
-            }}
-            }}
-            """
-        ).substitute(
-            prev_annotation_uri=sparql_escape_uri(prev_annotation_uri),
-            new_annotation=sparql_escape_uri(new_annotation_uri),
-            new_annotation_uuid=sparql_escape_string(new_annotation_uuid),
-            new_statement=sparql_escape_uri(new_statement_uri),
-            new_statement_uuid=sparql_escape_string(new_statement_uuid),
-            entity_uri=sparql_escape_uri(entity_uri),
-            found_uri=sparql_escape_uri(found_uri),
-            activity=sparql_escape_uri(activity_uri),
-            activity_uuid=sparql_escape_string(activity_uuid),
-            agent_uri=sparql_escape_uri(settings.nel_agent_uri),
+        container_uuid = str(uuid.uuid4())
+        container_uri = f"http://data.lblod.info/id/data-container/{container_uuid}"
+
+        q = _NEL_ANNOTATION_TMPL.substitute(
+            prev_annotation_uri=_escape_uri_fast(prev_annotation_uri),
+            new_annotation=_escape_uri_fast(new_annotation_uri),
+            new_annotation_uuid=f'"""{new_annotation_uuid}"""',
+            new_statement=_escape_uri_fast(new_statement_uri),
+            new_statement_uuid=f'"""{new_statement_uuid}"""',
+            entity_uri=_escape_uri_fast(entity_uri),
+            found_uri=_escape_uri_fast(found_uri),
+            activity=_escape_uri_fast(activity_uri),
+            activity_uuid=f'"""{activity_uuid}"""',
+            agent_uri=_NEL_AGENT_URI,
             start_time=f'"{start_time}"^^xsd:dateTime',
             end_time=f'"{end_time}"^^xsd:dateTime',
-            extra_triples=extra_triples
+            extra_triples=extra_triples,
         )
+        self.queue_update(_NEL_ANNOTATION_PREFIXES, q)
 
-        update(q, sudo=True)
-
-        return new_annotation_uri
-
-    def create_output_container(self, resource: str) -> str:
-        """
-        Function to create an output data container with a resource
-
-        Args:
-            resource: String containing an URI of a resource that should be added to the container with the task:hasResource property
-
-        Returns:
-            String containing the URI of the output data container
-        """
-        container_id = str(uuid.uuid4())
-        container_uri = f"http://data.lblod.info/id/data-container/{container_id}"
-
-        q = Template(
-            get_prefixes_for_query("task", "nfo", "mu") +
-            f"""
-            INSERT DATA {{
-            GRAPH <{settings.default_graph}> {{
-                $container a nfo:DataContainer ;
-                    mu:uuid "$uuid" ;
-                    task:hasResource $resource .
-            }}
-            }}
-            """
-        ).substitute(
-            container=sparql_escape_uri(container_uri),
-            uuid=container_id,
-            resource=sparql_escape_uri(resource)
+        q = _NEL_RESULTS_CONTAINER_TMPL.substitute(
+            container=_escape_uri_fast(container_uri),
+            container_uuid=container_uuid,
+            new_annotation=_escape_uri_fast(new_annotation_uri),
+            task=self._task_uri_escaped,
         )
+        self.queue_update(_NEL_ANNOTATION_PREFIXES, q)
 
-        update(q, sudo=True)
-        return container_uri
+        return new_annotation_uri
 
     async def process(self):
         """
@@ -408,91 +420,100 @@ class NamedEntityLinkingTask(Task, ABC):
          - sends query to LLM to retrieve the URI of the entity based on its class, label and (optionally) location
          - creates a new NEL annotation referencing the original, adds skos:exactMatch and provenance
         """
-        inputs = self.fetch_data_from_input_container()
+        inputs = await self.fetch_data_from_input_container()
 
         if inputs is None:
-            success = True
             return
 
-        for input in inputs:
-            self.retries = 0
-            success = False
-            while not success and self.retries < settings.llm_max_retries:
-                self.retries += 1
+        # Inputs are independent, link them concurrently up to the LLM concurrency limit
+        semaphore = asyncio.Semaphore(settings.llm_concurrency)
+
+        async def guarded(input):
+            async with semaphore:
                 try:
-                    logger.info(
-                        f"Processing task {self.task_uri} of type {self.__task_type__}")
+                    await self.process_input(input)
+                except Exception as e:
+                    # Recorded per input, the annotations of the other inputs are still written
+                    logger.error(f"Giving up on {input.get('annotation')} of task {self.task_uri}: {e}")
+                    self.failed_inputs.append((input, e))
 
-                    logger.info(settings)
-                    logger.info(endpoints)
-                    logger.info(
-                        f"Fetched input for task {self.task_uri}: {input}")
+        await asyncio.gather(*(guarded(input) for input in inputs))
+
+    async def process_input(self, input: dict) -> None:
+        """Link a single recognized entity, retrying up to llm_max_retries times and raising the last error after that."""
+        for attempt in range(1, settings.llm_max_retries + 1):
+            try:
+                logger.info(
+                    f"Processing task {self.task_uri} of type {self.__task_type__}")
 
-                    if input["location"] == "Unknown location":
-                        governing_unit_uri = self.fetch_governing_unit_uri()
-                        location = self.fetch_governing_unit_name(governing_unit_uri)
-                    else:
-                        location = input["location"]
+                logger.info(settings)
+                logger.info(endpoints)
+                logger.info(
+                    f"Fetched input for task {self.task_uri}: {input}")
 
-                    logger.info(
-                        f"Sending query to LLM for task {self.task_uri} with entity class {input['entityClass']} and entity label {input['entityLabel']} and location {location}")
+                if input["location"] == "Unknown location":
+                    governing_unit_uri = await self.fetch_governing_unit_uri()
+                    location = await self.fetch_governing_unit_name(governing_unit_uri)
+                else:
+                    location = input["location"]
+
+                logger.info(
+                    f"Sending query to LLM for task {self.task_uri} with entity class {input['entityClass']} and entity label {input['entityLabel']} and location {location}")
 
-                    start_time = datetime.now(timezone.utc).isoformat()
+                start_time = datetime.now(timezone.utc).isoformat()
 
-                    response: SparqlResponse = await self.agent_instance.run_sparql_request_structured(
-                        entity_class=input["entityClass"],
-                        entity_label=input["entityLabel"],
-                        location=location
+                response: SparqlResponse = await self.agent_instance.run_sparql_request_structured(
+                    entity_class=input["entityClass"],
+                    entity_label=input["entityLabel"],
+                    location=location
+                )
+                results = response.results
+                logger.info(
+                    f"Received result from LLM for task {self.task_uri}: {results}")
+
+                if len(results) > 0 and results[0].uri:
+                    best_uri = results[0].uri
+                    extra_triples = ""
+
+                    if "openstreetmap.org" in best_uri:
+                        try:
+                            # e.g., https://www.openstreetmap.org/way/12345
+                            parts = best_uri.rstrip('/').split('/')
+                            osm_type = parts[-2]
+                            osm_id = parts[-1]
+
+                            lookup_result = await GEOCODER.lookup_osm(osm_type, osm_id)
+                            
+                            if lookup_result:
+                                parser = NominatimParser()
+                                extracted_info = parser.detect_and_extract(lookup_result)
+                                # Fetch ?entity representing the annotation body
+                                subject_uri = input.get("entity")
+                                extra_triples = parser.format_triples(extracted_info, subject_uri=subject_uri)
+                        except Exception as ne:
+                            logger.error(f"Failed to fetch/parse Nominatim info for {best_uri}: {ne}")
+
+                    end_time = datetime.now(timezone.utc).isoformat()
+
+                    logger.info(f"Creating NEL annotation and output container linking to found URI {best_uri} for {input['entity']} of task {self.task_uri}")
+                    await self.create_nel_annotation(
+                        prev_annotation_uri=input["annotation"],
+                        entity_uri=input["entity"],
+                        found_uri=best_uri,
+                        extra_triples=extra_triples,
+                        start_time=start_time,
+                        end_time=end_time
                     )
-                    results = response.results
+                    logger.info(f"Successfully processed task {self.task_uri}")
+
+                break
+            except Exception as e:
+                logger.error(f"Error processing task {self.task_uri}: {e}")
+                if attempt >= settings.llm_max_retries:
+                    logger.error(
+                        f"Max retries reached for task {self.task_uri}. Failing task.")
+                    raise
+                else:
                     logger.info(
-                        f"Received result from LLM for task {self.task_uri}: {results}")
-
-                    if len(results) > 0 and results[0].uri:
-                        best_uri = results[0].uri
-                        extra_triples = ""
-
-                        if "openstreetmap.org" in best_uri:
-                            try:
-                                # e.g., https://www.openstreetmap.org/way/12345
-                                parts = best_uri.rstrip('/').split('/')
-                                osm_type = parts[-2]
-                                osm_id = parts[-1]
-
-                                geocoder = NominatimGeocoder(base_url=settings.nominatim_endpoint)
-                                lookup_result = await geocoder.lookup_osm(osm_type, osm_id)
-                                
-                                if lookup_result:
-                                    parser = NominatimParser()
-                                    extracted_info = parser.detect_and_extract(lookup_result)
-                                    # Fetch ?entity representing the annotation body
-                                    subject_uri = input.get("entity")
-                                    extra_triples = parser.format_triples(extracted_info, subject_uri=subject_uri)
-                            except Exception as ne:
-                                logger.error(f"Failed to fetch/parse Nominatim info for {best_uri}: {ne}")
-
-                        end_time = datetime.now(timezone.utc).isoformat()
-
-                        logger.info(f"Creating NEL annotation and linking to found URI {best_uri} for {input['entity']} of task {self.task_uri}")
-                        new_annotation = self.create_nel_annotation(
-                            prev_annotation_uri=input["annotation"],
-                            entity_uri=input["entity"],
-                            found_uri=best_uri,
-                            extra_triples=extra_triples,
-                            start_time=start_time,
-                            end_time=end_time
-                        )
-                        logger.info(f"Successfully processed task {self.task_uri}, creating output container for result")
-                        self.results_container_uris.append(self.create_output_container(resource=new_annotation))
-                        logger.info(f"Finished creating output container for task {self.task_uri}")
-
-                    success = True
-                except Exception as e:
-                    logger.error(f"Error processing task {self.task_uri}: {e}")
-                    if self.retries >= settings.llm_max_retries:
-                        logger.error(
-                            f"Max retries reached for task {self.task_uri}. Failing task.")
-                    else:
-                        logger.info(
-                            f"Retrying task {self.task_uri} (attempt {self.retries}/{settings.llm_max_retries})")
-                        await asyncio.sleep(5)
+                        f"Retrying task {self.task_uri} (attempt {attempt}/{settings.llm_max_retries})")
+                    await asyncio.sleep(5)
@@ -4,26 +4,50 @@ import asyncio
 from typing import List, Dict, Any, Optional
 
 import httpx
+import orjson
+
+from config.config import settings
+from src.utils.cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# Marks a cache miss, None is a valid cached result
+_MISS = object()
+
 
 class NominatimGeocoder:
     """ Nominatim geocoder helper (lightweight)."""
 
-    def __init__(self, base_url: str = "http://localhost:8080", rate_limit: float = 1.0, timeout: float = 10.0):
+    def __init__(self, base_url: str = "http://localhost:8080", rate_limit: float = 1.0, timeout: float = 10.0,
+                 cache_size: int = 10000, cache_ttl: float = 86400.0):
         self.base_url = base_url.rstrip('/')
         self.rate_limit = max(0.0, rate_limit)
         self.timeout = timeout
         self._last = 0.0
+        self._throttle_lock = asyncio.Lock()
+        # Shared keep-alive pool, reused across requests to the same server.
+        # HTTP/2 multiplexes concurrent requests over a single connection.
+        self._client = httpx.AsyncClient(http2=True, timeout=timeout, limits=HTTP_LIMITS)
+        # Entity labels recur across documents, successful responses are cached per normalized request
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP connection pool."""
+        await self._client.aclose()
 
     async def _throttle(self) -> None:
-        """Simple rate limiter based on minimum seconds between calls."""
-        now = time.monotonic()
-        wait = self.rate_limit - (now - self._last)
-        if wait > 0:
-            await asyncio.sleep(wait)
-        self._last = time.monotonic()
+        """
+        Rate limiter based on minimum seconds between calls.
+        Each caller reserves the next free slot under a lock, so concurrent requests are spaced out instead of racing on _last.
+        """
+        async with self._throttle_lock:
+            now = time.monotonic()
+            slot = max(now, self._last + self.rate_limit)
+            self._last = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
 
     async def search(self, query: str, city: Optional[str] = "Gent", country: Optional[str] = "BE,DE", limit: int = 1) -> Optional[Dict[str, Any]]:
         """
@@ -34,6 +58,11 @@ class NominatimGeocoder:
         if not query or not query.strip():
             return None
 
+        cache_key = ("search", query.strip().lower(), (city or "").strip().lower(), (country or "").strip().lower(), limit)
+        cached = self._cache.get(cache_key, _MISS)
+        if cached is not _MISS:
+            return cached
+
         await self._throttle()
 
         # Build query string
@@ -55,13 +84,12 @@ class NominatimGeocoder:
             params["countrycodes"] = country.strip()
 
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"{self.base_url}/search", params=params, timeout=self.timeout)
-                resp.raise_for_status()
-                results = resp.json()
-                if not results:
-                    return None
-                return self._format(results[0], original_query=query)
+            resp = await self._client.get(f"{self.base_url}/search", params=params, timeout=self.timeout)
+            resp.raise_for_status()
+            results = orjson.loads(resp.content)
+            result = self._format(results[0], original_query=query) if results else None
+            self._cache.set(cache_key, result)
+            return result
         except httpx.RequestError as exc:
             logger.warning("Nominatim request failed for %r: %s", query, exc)
             return None
@@ -73,8 +101,6 @@ class NominatimGeocoder:
         """
         Query /lookup on the Nominatim server by OSM type and ID.
         """
-        await self._throttle()
-        
         # map generic openstreetmap types to Nominatim types (N, W, R)
         type_map = {'node': 'N', 'way': 'W', 'relation': 'R'}
         n_type = type_map.get(osm_type.lower(), osm_type[0].upper() if osm_type else "")
@@ -82,6 +108,13 @@ class NominatimGeocoder:
             return None
             
         osm_ids = f"{n_type}{osm_id}"
+
+        cache_key = ("lookup", osm_ids)
+        cached = self._cache.get(cache_key, _MISS)
+        if cached is not _MISS:
+            return cached
+
+        await self._throttle()
         
         params = {
             "osm_ids": osm_ids,
@@ -92,13 +125,12 @@ class NominatimGeocoder:
         }
 
         try:
-            async with httpx.AsyncClient() as client:
-                resp = await client.get(f"{self.base_url}/lookup", params=params, timeout=self.timeout)
-                resp.raise_for_status()
-                results = resp.json()
-                if not results:
-                    return None
-                return results[0]
+            resp = await self._client.get(f"{self.base_url}/lookup", params=params, timeout=self.timeout)
+            resp.raise_for_status()
+            results = orjson.loads(resp.content)
+            result = results[0] if results else None
+            self._cache.set(cache_key, result)
+            return result
         except httpx.RequestError as exc:
             logger.warning("Nominatim request failed for %s%s: %s", osm_type, osm_id, exc)
             return None
@@ -108,10 +140,10 @@ class NominatimGeocoder:
 
     def _format(self, r: Dict[str, Any], original_query: str) -> Dict[str, Any]:
         """Return compact result structure (keep only useful keys)."""
-        addr = r.get("address", {})
+        addr = r.get("address") or {}
+        get_addr = addr.get
         osm_type = r.get("osm_type")
         osm_id = r.get("osm_id")
-        osm_url = f"https://www.openstreetmap.org/{osm_type}/{osm_id}" if osm_type and osm_id else None
 
         return {
             "query": original_query,
@@ -122,16 +154,24 @@ class NominatimGeocoder:
             "place_id": r.get("place_id"),
             "osm_type": osm_type,
             "osm_id": osm_id,
-            "osm_url": osm_url,
+            "osm_url": f"https://www.openstreetmap.org/{osm_type}/{osm_id}" if osm_type and osm_id else None,
             "address": {
-                "house_number": addr.get("house_number"),
-                "road": addr.get("road"),
-                "city": addr.get("city") or addr.get("town") or addr.get("village"),
-                "postcode": addr.get("postcode"),
-                "country": addr.get("country"),
-                "country_code": addr.get("country_code"),
+                "house_number": get_addr("house_number"),
+                "road": get_addr("road"),
+                "city": get_addr("city") or get_addr("town") or get_addr("village"),
+                "postcode": get_addr("postcode"),
+                "country": get_addr("country"),
+                "country_code": get_addr("country_code"),
             },
             "bbox": r.get("boundingbox"),
             "type": r.get("type"),
             "class": r.get("class"),
         }
+
+
+# The one geocoder of the process: the MCP tool and the tasks share its rate limit, cache and connection pool
+GEOCODER = NominatimGeocoder(
+    base_url=settings.nominatim_endpoint,
+    cache_size=settings.tool_cache_size,
+    cache_ttl=settings.tool_cache_ttl,
+)
@@ -2,10 +2,44 @@ import logging
 import re
 from typing import List, Dict, Any, Optional
 import httpx
+import orjson
 
 # Configure logging (usually done at the app level)
 logger = logging.getLogger(__name__)
 
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+
+# SELECT query form after the PREFIX/BASE prologue
+_SELECT_QUERY = re.compile(r"^(?:\s*(?:PREFIX\s+[^:\s]*:\s*<[^>]*>|BASE\s+<[^>]*>))*\s*SELECT\b", re.IGNORECASE)
+_HAS_LIMIT = re.compile(r"\bLIMIT\s+\d+", re.IGNORECASE)
+_TRAILING_VALUES = re.compile(r"\bVALUES\b[^{}]*\{[^{}]*\}\s*$", re.IGNORECASE)
+
+# Pattern explanation:
+# 1. ("""...""") or ('''...'''): Multi-line strings
+# 2. ("...") or ('...'): Single-line strings (handling escaped quotes)
+# 3. (<...>): IRIs
+# 4. (#.*): Comments (what we want to remove)
+_COMMENT_PATTERN = re.compile(
+    r'("""[\s\S]*?""")|'
+    r"('''[\s\S]*?''')|"
+    r'("(?:\\.|[^"\\])*")|'
+    r"('(?:\\.|[^'\\])*')|"
+    r'(<[^>]*>)|'
+    r'(#.*)',
+    re.UNICODE
+)
+# Runs of empty or whitespace-only lines
+_BLANK_LINES = re.compile(r"\n\s*\n")
+
+def _keep_non_comment(match: re.Match) -> str:
+    # If the 6th group (comment) is matched, return empty string.
+    # Otherwise, return the match (string or IRI) as is.
+    return "" if match.group(6) else match.group(0)
+
+def strip_sparql_comments(query: str) -> str:
+    """Remove # comments from a SPARQL query, keeping # inside strings and IRIs."""
+    return _COMMENT_PATTERN.sub(_keep_non_comment, query)
+
 class SparqlClient:
     """
     A client to perform SPARQL searches against a specific endpoint.
@@ -19,6 +53,13 @@ class SparqlClient:
             endpoint (str): The SPARQL endpoint URL.
         """
         self.endpoint = endpoint
+        # Shared keep-alive pool, reused across searches on this endpoint.
+        # HTTP/2 multiplexes concurrent queries over a single connection.
+        self._client = httpx.AsyncClient(http2=True, timeout=60.0, limits=HTTP_LIMITS)
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP connection pool."""
+        await self._client.aclose()
 
     @staticmethod
     def _sanitize_query(query: str) -> str:
@@ -26,30 +67,22 @@ class SparqlClient:
         Removes comments from a SPARQL query while preserving # inside strings/IRIs.
         Handles escaped quotes and multi-line strings via Regex.
         """
-        # Pattern explanation:
-        # 1. ("""...""") or ('''...'''): Multi-line strings
-        # 2. ("...") or ('...'): Single-line strings (handling escaped quotes)
-        # 3. (<...>): IRIs
-        # 4. (#.*): Comments (what we want to remove)
-        pattern = re.compile(
-            r'("""(?:.|\n)*?""")|' 
-            r"('''(?:.|\n)*?''')|" 
-            r'("(?:\\.|[^"\\])*")|' 
-            r"('(?:\\.|[^'\\])*')|" 
-            r'(<[^>]*>)|' 
-            r'(#.*)', 
-            re.UNICODE
-        )
-
-        def replacer(match):
-            # If the 6th group (comment) is matched, return empty string.
-            # Otherwise, return the match (string or IRI) as is.
-            if match.group(6):
-                return ""
-            return match.group(0)
-
-        cleaned = pattern.sub(replacer, query)
-        return "\n".join([line for line in cleaned.splitlines() if line.strip()])
+        cleaned = strip_sparql_comments(query)
+        return _BLANK_LINES.sub("\n", cleaned).strip()
+
+    @staticmethod
+    def _add_limit(query: str, limit: int) -> str:
+        """
+        Append a LIMIT to SELECT queries that don't have one, so the endpoint doesn't send rows we would drop.
+        Queries ending in a VALUES block are left alone, a LIMIT can't follow it.
+        """
+        if (
+            _SELECT_QUERY.match(query)
+            and not _HAS_LIMIT.search(query)
+            and not _TRAILING_VALUES.search(query)
+        ):
+            return f"{query}\nLIMIT {limit}"
+        return query
 
     async def search(self, query: str, max_results: Optional[int] = None) -> List[Dict[str, Any]]:
         """
@@ -57,8 +90,8 @@ class SparqlClient:
 
         Args:
             query (str): The SPARQL query string.
-            max_results (int, optional): Truncate results list to this length. 
-                                         Note: Use SPARQL 'LIMIT' for server-side optimization.
+            max_results (int, optional): Truncate results list to this length.
+                                         Added as a LIMIT to SELECT queries that don't set one.
 
         Returns:
             List[Dict[str, Any]]: A list of binding dictionaries.
@@ -67,18 +100,20 @@ class SparqlClient:
             RuntimeError: If the SPARQL query fails.
         """
         clean_query = self._sanitize_query(query)
+        if max_results:
+            clean_query = self._add_limit(clean_query, max_results)
         logger.debug(f"Executing SPARQL Query:\n{clean_query}")
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
-                    self.endpoint, 
-                    params={"query": clean_query, "format": "json"},
-                    headers={"Accept": "application/sparql-results+json"},
-                    timeout=120
-                )
-                response.raise_for_status()
-                data = response.json()
+            # POST keeps long queries clear of URL length limits and out of intermediate caches
+            response = await self._client.post(
+                self.endpoint, 
+                data={"query": clean_query, "format": "json"},
+                headers={"Accept": "application/sparql-results+json"},
+                timeout=120
+            )
+            response.raise_for_status()
+            data = orjson.loads(response.content)
             
             bindings = data.get("results", {}).get("bindings", [])
             
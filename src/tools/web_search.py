@@ -1,10 +1,62 @@
-import time
 import random
 import asyncio
+from html.parser import HTMLParser
 from typing import List, Dict, Optional
+from urllib.parse import parse_qs, urlparse
 
-from ddgs import DDGS
-from httpx import ReadTimeout, ConnectTimeout
+import httpx
+
+from src.utils.cache import TTLCache
+
+DDG_HTML_URL = "https://html.duckduckgo.com/html/"
+
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=10, max_connections=20)
+
+
+class _RateLimited(Exception):
+    """DuckDuckGo answered with its anti-bot / rate limit page."""
+
+
+class _ResultsParser(HTMLParser):
+    """Collect title, href and body of the organic results on DuckDuckGo's HTML page."""
+
+    def __init__(self):
+        super().__init__()
+        self.results: List[Dict] = []
+        self._field: Optional[str] = None
+        self._text: List[str] = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag != "a":
+            return
+        attrs = dict(attrs)
+        classes = (attrs.get("class") or "").split()
+        if "result__a" in classes:
+            href = _unwrap_redirect(attrs.get("href") or "")
+            # Ads link through y.js, skip them
+            if href and "duckduckgo.com/y.js" not in href:
+                self.results.append({"title": "", "href": href, "body": ""})
+                self._field = "title"
+                self._text = []
+        elif "result__snippet" in classes and self.results:
+            self._field = "body"
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if tag == "a" and self._field:
+            self.results[-1][self._field] = " ".join("".join(self._text).split())
+            self._field = None
+
+    def handle_data(self, data):
+        if self._field:
+            self._text.append(data)
+
+
+def _unwrap_redirect(href: str) -> str:
+    """Result links go through //duckduckgo.com/l/?uddg=<target>, return the target."""
+    if href.startswith("//duckduckgo.com/l/"):
+        return parse_qs(urlparse(href).query).get("uddg", [""])[0]
+    return href
 
 
 class DuckDuckGoSearch:
@@ -14,41 +66,62 @@ class DuckDuckGoSearch:
         base_delay: float = 1.0,
         max_delay: float = 10.0,
         timeout: float = 10.0,
+        cache_size: int = 10000,
+        cache_ttl: float = 86400.0,
     ):
         """
         :param max_retries: how many times to retry on failure
         :param base_delay: initial backoff delay (seconds)
         :param max_delay: maximum delay between retries
         :param timeout: request timeout (seconds)
+        :param cache_size: number of queries whose results are cached, 0 disables caching
+        :param cache_ttl: how long cached results are reused (seconds)
         """
         self.max_retries = max_retries
         self.base_delay = base_delay
         self.max_delay = max_delay
         self.timeout = timeout
+        # Shared keep-alive pool, reused across searches
+        self._client = httpx.AsyncClient(
+            http2=True,
+            timeout=timeout,
+            limits=HTTP_LIMITS,
+            headers={"User-Agent": "Mozilla/5.0 (compatible; entity-linking-backend)"},
+        )
+        self._cache = TTLCache(maxsize=cache_size, ttl=cache_ttl)
+
+    async def aclose(self) -> None:
+        """Close the underlying HTTP connection pool."""
+        await self._client.aclose()
+
+    async def _fetch(self, query: str) -> List[Dict]:
+        response = await self._client.post(DDG_HTML_URL, data={"q": query, "b": "", "kl": "wt-wt"})
+        if response.status_code in (202, 429):
+            raise _RateLimited(response.status_code)
+        response.raise_for_status()
+        parser = _ResultsParser()
+        parser.feed(response.text)
+        return parser.results
 
     async def search(
         self,
         query: str,
         max_results: int = 5,
     ) -> List[Dict]:
-        return await asyncio.to_thread(self._search_sync, query, max_results)
+        cache_key = " ".join(query.lower().split())
+        cached = self._cache.get(cache_key)
+        if cached is not None:
+            return cached[:max_results]
 
-    def _search_sync(
-        self,
-        query: str,
-        max_results: int = 5,
-    ) -> List[Dict]:
         attempt = 0
 
         while attempt <= self.max_retries:
             try:
-                with DDGS(timeout=self.timeout) as ddgs:
-                    results = list(
-                        ddgs.text(query, max_results=max_results)
-                    )
-                    return results
+                results = await self._fetch(query)
+                self._cache.set(cache_key, results)
+                return results[:max_results]
 
-            except (ReadTimeout, ConnectTimeout, TimeoutError) as e:
+            except (httpx.TimeoutException, _RateLimited) as e:
                 attempt += 1
                 if attempt > self.max_retries:
                     raise RuntimeError(
@@ -60,10 +133,10 @@ class DuckDuckGoSearch:
                     self.max_delay,
                 )
                 delay += random.uniform(0, 0.5)  # jitter
-                time.sleep(delay)
+                await asyncio.sleep(delay)
 
             except Exception as e:
                 # Non-network error → fail fast
-                raise RuntimeError("Unexpected DDGS error") from e
+                raise RuntimeError("Unexpected DuckDuckGo error") from e
 
         return []
@@ -0,0 +1,32 @@
+# Translation tables for str.translate, applied in C instead of a per-match regex callback
+_STRING_ESCAPE = str.maketrans({"\\": "\\\\", '"': '\\"', "'": "\\'"})
+_URI_ESCAPE = str.maketrans({"\\": "\\\\", '"': '\\"', "<": "\\<", ">": "\\>"})
+
+
+def sparql_escape_string(obj) -> str:
+    """Converts the given string to a SPARQL-safe RDF object string with the right RDF-datatype."""
+    if not isinstance(obj, str):
+        _warn("You are escaping something that isn't a string with the 'sparql_escape_string'-method. Implicit casting will occurr.")
+        obj = str(obj)
+    return _escape_string_fast(obj)
+
+
+def sparql_escape_uri(obj) -> str:
+    """Converts the given URI to a SPARQL-safe RDF object string with the right RDF-datatype."""
+    return "<" + str(obj).translate(_URI_ESCAPE) + ">"
+
+
+def _escape_string_fast(obj: str) -> str:
+    """sparql_escape_string for values already known to be a str, skips the type check."""
+    return '"""' + obj.translate(_STRING_ESCAPE) + '"""'
+
+
+def _escape_uri_fast(obj: str) -> str:
+    """sparql_escape_uri for values already known to be a str, skips the cast."""
+    return "<" + obj.translate(_URI_ESCAPE) + ">"
+
+
+def _warn(*args) -> None:
+    # warnings is only needed on the rare mistyped call
+    from warnings import warn
+    warn(*args, stacklevel=3)
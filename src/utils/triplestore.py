@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+import re
+import threading
+
+import httpx
+import orjson
+
+from config.config import settings
+from helpers import logger
+from src.tools.sparql_search import strip_sparql_comments
+from src.utils.cache import TTLCache
+
+# One keep-alive pool for all triplestore requests, replaces the per-call SPARQLWrapper of the template helpers.
+# httpx.Client is thread-safe, concurrent query()/update() calls from worker threads each check out their own
+# connection, so the pool is sized to the number of threads that query at once instead of guarded by a lock.
+HTTP_LIMITS = httpx.Limits(
+    max_keepalive_connections=settings.sparql_pool_size,
+    max_connections=settings.sparql_pool_size,
+)
+
+# Transport retries (both pools) only cover failing to open a connection (connect error or timeout), so the request
+# was never sent. A write that reached the triplestore is never resent, which keeps retries safe for updates.
+_client = httpx.Client(
+    transport=httpx.HTTPTransport(http2=True, limits=HTTP_LIMITS, retries=3),
+    timeout=120.0,
+)
+# Async pool for the event loop, concurrent task queries share its connections
+ASYNC_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+_async_client = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(http2=True, limits=ASYNC_HTTP_LIMITS, retries=3),
+    timeout=120.0,
+)
+
+# Results of read queries issued with cache=True, cleared on every update() from this service.
+# Queries are issued from the event loop and from worker threads, hence the lock.
+_query_cache = TTLCache(maxsize=settings.query_cache_size, ttl=settings.query_cache_ttl)
+_query_cache_lock = threading.RLock()
+_query_cache_stats = {"hits": 0, "misses": 0}
+
+# Request counters of both pools, httpx exposes no pool stats of its own
+_request_stats = {"requests": 0, "in_flight": 0, "max_in_flight": 0}
+_request_stats_lock = threading.Lock()
+
+
+@contextlib.contextmanager
+def _tracked():
+    with _request_stats_lock:
+        _request_stats["requests"] += 1
+        _request_stats["in_flight"] += 1
+        _request_stats["max_in_flight"] = max(_request_stats["max_in_flight"], _request_stats["in_flight"])
+    try:
+        yield
+    finally:
+        with _request_stats_lock:
+            _request_stats["in_flight"] -= 1
+
+
+def _headers(sudo: bool, accept: str) -> dict[str, str]:
+    headers = {"Accept": accept}
+    if sudo:
+        headers["mu-auth-sudo"] = "true"
+    return headers
+
+
+# One PREFIX declaration at the start of the query
+_LEADING_PREFIX = re.compile(r"\s*PREFIX\s+([^:\s]*:)\s*(<[^>]*>)", re.IGNORECASE)
+
+
+def _canonicalize(the_query: str) -> str:
+    """
+    Cache key form of a query: comments stripped, PREFIX declarations sorted, whitespace collapsed.
+    Variable names are kept, they are the keys of the returned bindings.
+    """
+    body = strip_sparql_comments(the_query)
+    prefixes = []
+    while match := _LEADING_PREFIX.match(body):
+        prefixes.append(f"PREFIX {match[1]} {match[2]}")
+        body = body[match.end():]
+    prefixes.sort()
+    prefixes.append(" ".join(body.split()))
+    return " ".join(prefixes)
+
+
+def _cache_key(the_query: str, sudo: bool) -> tuple[str, bool]:
+    return _canonicalize(the_query), sudo
+
+
+def _cached(key: tuple[str, bool]):
+    with _query_cache_lock:
+        result = _query_cache.get(key)
+        _query_cache_stats["hits" if result is not None else "misses"] += 1
+    return result
+
+
+def _store(key: tuple[str, bool], result: dict) -> None:
+    with _query_cache_lock:
+        _query_cache.set(key, result)
+
+
+def _invalidate() -> None:
+    with _query_cache_lock:
+        _query_cache.clear()
+
+
+def query(the_query: str, sudo: bool = False, cache: bool = False) -> dict:
+    """
+    Execute the given SPARQL query (select/ask/construct) on the triplestore and return the parsed JSON results.
+
+    With cache=True identical reads within QUERY_CACHE_TTL seconds are served from memory. Only use it for data
+    that other services don't change, writes by this service clear the cache.
+    Blocks, use aquery() from async code.
+    """
+    if cache:
+        key = _cache_key(the_query, sudo)
+        if (result := _cached(key)) is not None:
+            return result
+
+    logger.debug(f"Execute query: \n{the_query}")
+    with _tracked():
+        response = _client.post(
+            settings.mu_sparql_endpoint,
+            data={"query": the_query},
+            headers=_headers(sudo, "application/sparql-results+json"),
+        )
+    response.raise_for_status()
+    result = orjson.loads(response.content)
+    if cache:
+        _store(key, result)
+    return result
+
+
+def update(the_query: str, sudo: bool = False) -> None:
+    """Execute the given SPARQL update on the triplestore. Blocks, use aupdate() from async code."""
+    logger.debug(f"Execute update: \n{the_query}")
+    with _tracked():
+        response = _client.post(
+            settings.mu_sparql_updatepoint or settings.mu_sparql_endpoint,
+            data={"update": the_query},
+            headers=_headers(sudo, "application/sparql-results+json"),
+        )
+    response.raise_for_status()
+    _invalidate()
+
+
+async def aquery(the_query: str, sudo: bool = False, cache: bool = False) -> dict:
+    """Async variant of query() that doesn't block the event loop."""
+    if cache:
+        key = _cache_key(the_query, sudo)
+        if (result := _cached(key)) is not None:
+            return result
+
+    logger.debug(f"Execute query: \n{the_query}")
+    with _tracked():
+        response = await _async_client.post(
+            settings.mu_sparql_endpoint,
+            data={"query": the_query},
+            headers=_headers(sudo, "application/sparql-results+json"),
+        )
+    response.raise_for_status()
+    result = orjson.loads(response.content)
+    if cache:
+        _store(key, result)
+    return result
+
+
+async def aupdate(the_query: str, sudo: bool = False) -> None:
+    """Async variant of update() that doesn't block the event loop."""
+    logger.debug(f"Execute update: \n{the_query}")
+    with _tracked():
+        response = await _async_client.post(
+            settings.mu_sparql_updatepoint or settings.mu_sparql_endpoint,
+            data={"update": the_query},
+            headers=_headers(sudo, "application/sparql-results+json"),
+        )
+    response.raise_for_status()
+    _invalidate()
+
+
+async def warm_up(queries: list[str]) -> None:
+    """Run the given read queries with cache=True, so their results are cached before the first task needs them."""
+    results = await asyncio.gather(*(aquery(q, sudo=True, cache=True) for q in queries), return_exceptions=True)
+    for q, result in zip(queries, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Warm-up query failed: {result}\n{q}")
+    logger.info(f"Query cache warmed: {query_cache_info()}")
+
+
+def query_cache_info() -> dict[str, int]:
+    """Hit/miss counters and current size of the read query cache."""
+    with _query_cache_lock:
+        return {**_query_cache_stats, "size": len(_query_cache)}
+
+
+def pool_info() -> dict[str, int]:
+    """Triplestore request counters and the connection limits of the sync pool."""
+    with _request_stats_lock:
+        stats = dict(_request_stats)
+    return {
+        **stats,
+        "max_connections": HTTP_LIMITS.max_connections,
+        "max_keepalive_connections": HTTP_LIMITS.max_keepalive_connections,
+    }
+
+
+async def aclose() -> None:
+    """Close the connection pools, called on app shutdown."""
+    _client.close()
+    await _async_client.aclose()
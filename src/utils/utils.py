@@ -1,36 +1,101 @@
 
+import logging
+import queue
+import sys
 import time
+from functools import lru_cache
+from typing import Callable, Optional
+from logging.handlers import QueueHandler, QueueListener
+from io import StringIO
+from types import MappingProxyType
+import httpx
 from qdrant_client.models import ScoredPoint
-from helpers import logger, query
+from helpers import logger
+from src.utils.triplestore import query
 from config.config import settings, entity_class_configs
 from src.agent import Agent, AgentConfig
 
 def format_docs(docs: list[ScoredPoint]) -> str:
     """Format a list of documents."""
-    return "\n".join(_format_doc(doc) for doc in docs)
-
-
-def _format_doc(doc: ScoredPoint) -> str:
-    """Format a single document, with special formatting based on doc type (sparql, schema)."""
-    if not doc.payload:
-        return ""
-    doc_meta: dict[str, str] = doc.payload.get("metadata", {})
-    if doc_meta.get("answer"):
-        doc_lang = ""
-        doc_type = str(doc_meta.get("doc_type", "")).lower()
-        if "query" in doc_type:
-            doc_lang = f"sparql\n#+ endpoint: {doc_meta.get('endpoint_url', 'undefined')}"
-        elif "schema" in doc_type:
-            doc_lang = "shex"
-        return f"{doc.payload['page_content']}:\n\n```{doc_lang}\n{doc_meta.get('answer')}\n```"
+    buf = StringIO()
+    for i, doc in enumerate(docs):
+        if i:
+            buf.write("\n")
+        _write_doc(buf, doc)
+    return buf.getvalue()
+
+
+def _lang_sparql(doc_meta: dict) -> str:
+    return f"sparql\n#+ endpoint: {doc_meta.get('endpoint_url', 'undefined')}"
+
+
+def _lang_shex(doc_meta: dict) -> str:
+    return "shex"
+
+
+def _lang_none(doc_meta: dict) -> str:
+    return ""
+
+
+# Code fence language per doc type, the doc types sparql-llm indexes are matched exactly
+_LANG_BY_TYPE = {
+    "SPARQL endpoints query examples": _lang_sparql,
+    "SPARQL endpoints classes schema": _lang_shex,
+    "query": _lang_sparql,
+    "sparql_query": _lang_sparql,
+    "schema": _lang_shex,
+    "shex_schema": _lang_shex,
+}
+
+
+def _classify_doc_type(doc_type) -> Callable[[dict], str]:
+    """Fallback for doc types missing from _LANG_BY_TYPE, classifies them on their name."""
+    doc_type = str(doc_type).lower()
+    if "query" in doc_type:
+        return _lang_sparql
+    if "schema" in doc_type:
+        return _lang_shex
+    return _lang_none
+
+
+def _write_doc(buf: StringIO, doc: ScoredPoint) -> None:
+    """Write a single formatted document to buf, with special formatting based on doc type (sparql, schema)."""
+    payload = doc.payload
+    if not payload:
+        return
+    write = buf.write
+    doc_meta: dict[str, str] = payload.get("metadata") or {}
+    answer = doc_meta.get("answer")
+    if answer:
+        write(payload["page_content"])
+        write(":\n\n```")
+        doc_type = doc_meta.get("doc_type", "")
+        lang = _LANG_BY_TYPE.get(doc_type) or _classify_doc_type(doc_type)
+        write(lang(doc_meta))
+        write("\n")
+        write(str(answer))
+        write("\n```")
+        return
     # Generic formatting:
-    meta = "".join(f" {k}={v!r}" for k, v in doc_meta.items())
-    if meta:
-        meta = f" {meta}"
-    return f"{meta}\n{doc.payload['page_content']}\n"
+    if doc_meta:
+        write(" ")
+        for k, v in doc_meta.items():
+            write(" ")
+            write(k)
+            write("=")
+            write(repr(v))
+    write("\n")
+    write(payload["page_content"])
+    write("\n")
 
 def initialize_agent() -> Agent:
-    # Initialize Agent
+    """Return the process-wide Agent, shared by the API and all tasks."""
+    return _agent_singleton()
+
+
+@lru_cache(maxsize=1)
+def _agent_singleton() -> Agent:
+    # Settings are frozen for the process lifetime, so the agent is built once
     api_key, endpoint, model = settings.get_llm_config()
     logger.info(f"Initializing Agent with provider={settings.llm_provider}, model={model}, endpoint={endpoint}")
     agent_conf = AgentConfig(
@@ -41,6 +106,7 @@ def initialize_agent() -> Agent:
         model=model,
         verbose=True,
         enabled_tools=settings.enabled_tools,
+        run_timeout=settings.agent_run_timeout,
         entity_class_configs=entity_class_configs
     )
     agent_instance = Agent(agent_conf)
@@ -52,7 +118,7 @@ def initialize_agent() -> Agent:
 # ==============================================================================
 # Maps prefix names to their full URIs for use in SPARQL queries
 
-SPARQL_PREFIXES = {
+SPARQL_PREFIXES = MappingProxyType({
     "mu": "http://mu.semte.ch/vocabularies/core/",
     "foaf": "http://xmlns.com/foaf/0.1/",
     "airo": "https://w3id.org/airo#",
@@ -81,7 +147,14 @@ SPARQL_PREFIXES = {
     "epvoc": "https://data.europarl.europa.eu/def/epvoc#",
     "nie": "http://www.semanticdesktop.org/ontologies/2007/01/19/nie#",
     "harvesting": "http://lblod.data.gift/vocabularies/harvesting/"
-}
+})
+
+_PREFIX_NAMES: frozenset[str] = frozenset(SPARQL_PREFIXES)
+
+# PREFIX declaration line per prefix name, formatted once at import
+_PREFIX_LINES = MappingProxyType({
+    name: sys.intern(f"PREFIX {name}: <{uri}>\n") for name, uri in SPARQL_PREFIXES.items()
+})
 
 def get_prefixes_for_query(*prefix_names: str) -> str:
     """
@@ -91,38 +164,85 @@ def get_prefixes_for_query(*prefix_names: str) -> str:
         *prefix_names: Variable number of prefix names to include
 
     Returns:
-        A string containing the requested PREFIX declarations
+        A string containing the requested PREFIX declarations, in alphabetical order
 
     Example:
         >>> query = get_prefixes_for_query("oa", "prov", "mu")
         >>> query += "SELECT ?s WHERE { ... }"
     """
-    lines = []
-    for prefix_name in prefix_names:
-        if prefix_name in SPARQL_PREFIXES:
-            uri = SPARQL_PREFIXES[prefix_name]
-            lines.append("PREFIX {0}: <{1}>".format(prefix_name, uri))
-    if not lines:
-        raise ValueError(f"No valid prefixes found in: {prefix_names}")
-    return "\n".join(lines) + "\n"
+    return _build_prefixes(frozenset(prefix_names))
+
+
+@lru_cache(maxsize=None)
+def _build_prefixes(prefix_names: frozenset[str]) -> str:
+    # Keyed on the set of names so every ordering of the same prefixes shares one block
+    if not prefix_names:
+        raise ValueError("No prefixes given")
+    unknown = prefix_names - _PREFIX_NAMES
+    if unknown:
+        raise ValueError(f"Unknown prefixes: {sorted(unknown)}")
+    return sys.intern("".join([_PREFIX_LINES[name] for name in sorted(prefix_names)]))
+
+
+# Backoff between triplestore liveness checks, in seconds
+TRIPLESTORE_WAIT_MAX_DELAY = 30
 
 
 def wait_for_triplestore():
-    triplestore_live = False
+    """
+    Block until the triplestore answers queries.
+    A cheap HEAD on the endpoint is polled first, with exponential backoff, the ASK query only runs once it responds.
+    """
     logger.info("Waiting for triplestore...")
-    while not triplestore_live:
-        try:
-            result = query(
-                """
-                SELECT ?s WHERE {
-                ?s ?p ?o.
-                } LIMIT 1""",
-            )
-            if result["results"]["bindings"][0]["s"]["value"]:
-                triplestore_live = True
-            else:
+    attempt = 0
+    with httpx.Client(timeout=2.0) as client:
+        while True:
+            try:
+                if client.head(settings.mu_sparql_endpoint).status_code < 500 and query("ASK { ?s ?p ?o }").get("boolean"):
+                    break
                 raise Exception("triplestore not ready yet...")
-        except Exception as _e:
-            logger.info(f"Triplestore not live yet, retrying...")
-            time.sleep(1)
-    logger.info("Triplestore ready!")
\ No newline at end of file
+            except Exception as _e:
+                delay = min(TRIPLESTORE_WAIT_MAX_DELAY, 2 ** attempt)
+                attempt += 1
+                logger.info(f"Triplestore not live yet, retrying in {delay}s...")
+                time.sleep(delay)
+    logger.info("Triplestore ready!")
+
+
+async def mcp_is_ready() -> bool:
+    """Check whether the MCP server answers on its configured URL."""
+    try:
+        async with httpx.AsyncClient(timeout=httpx.Timeout(1.0)) as client:
+            # The SSE endpoint streams forever, only wait for the response headers
+            async with client.stream("GET", settings.mcp_url) as response:
+                return response.status_code < 500
+    except httpx.HTTPError:
+        return False
+
+
+def start_queue_logging(target: logging.Logger) -> Optional[QueueListener]:
+    """
+    Move the handlers of `target` (file and console, installed by the template) behind a queue,
+    so logging calls only enqueue the record and the writes happen on the listener's thread.
+    """
+    handlers = [handler for handler in target.handlers if not isinstance(handler, QueueHandler)]
+    if not handlers:
+        return None
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    for handler in handlers:
+        target.removeHandler(handler)
+    target.addHandler(QueueHandler(log_queue))
+    listener.start()
+    return listener
+
+
+def stop_queue_logging(target: logging.Logger, listener: Optional[QueueListener]) -> None:
+    """Drain the queue and put the original handlers back on `target`, see start_queue_logging()."""
+    if listener is None:
+        return
+    listener.stop()
+    for handler in [handler for handler in target.handlers if isinstance(handler, QueueHandler)]:
+        target.removeHandler(handler)
+    for handler in listener.handlers:
+        target.addHandler(handler)